@@ -0,0 +1,88 @@
+"""
+Benchmark admission policy của response cache: replay chat logs (ndjson) và so sánh hit rate LRU vs TinyLFU
+Chạy: python bench-cache-policy.py chat-logs/ [--sizes 100,500,1000] [--max-bytes 0] [--s3]
+
+Log lấy từ file/thư mục .ndjson, .ndjson.gz đã export (hoặc trực tiếp từ S3 với --s3).
+Mỗi event có 'message' được replay theo thứ tự: tra cache, miss thì cache 'response' của event.
+Semantic tier và L2 bị tắt để chỉ so sánh chính sách của L1.
+"""
+import argparse
+import sys
+import time
+
+from server import cache, settings
+from server.cache_admission import TinyLFU
+from server.s3_logs import iter_local_events, list_log_objects, open_log_events
+
+
+def iter_s3_events():
+    for obj in list_log_objects():
+        events, _ = open_log_events(obj['Key'])
+        yield from events
+
+
+def load_requests(args):
+    if args.s3:
+        events = iter_s3_events()
+    else:
+        events = (ev for path in args.paths for ev in iter_local_events(path))
+    requests = []
+    for ev in events:
+        message = (ev.get('message') or '').strip()
+        if message:
+            requests.append((message, ev.get('context') or '', ev.get('response') or message))
+    return requests
+
+
+def replay(requests, policy: str, size: int, max_bytes: int) -> dict:
+    cache.CACHE_MAX_SIZE = size
+    cache.CACHE_MAX_BYTES = max_bytes
+    cache.admission = TinyLFU(size) if policy == 'tinylfu' else None
+    cache.clear_cache()
+    for key in cache._stats:
+        cache._stats[key] = 0
+
+    start = time.perf_counter()
+    hits = 0
+    for message, context, response in requests:
+        if cache.get_cached_response(message, context) is not None:
+            hits += 1
+        else:
+            cache.cache_response(message, context, response)
+    elapsed = time.perf_counter() - start
+    return {
+        'hit_rate': hits / len(requests),
+        'us_per_request': elapsed / len(requests) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay chat logs to compare LRU and TinyLFU hit rates')
+    parser.add_argument('paths', nargs='*', help='File/thư mục .ndjson hoặc .ndjson.gz')
+    parser.add_argument('--s3', action='store_true', help='Đọc chat-logs trực tiếp từ S3 (AWS_S3_BUCKET)')
+    parser.add_argument('--sizes', default='100,500,1000', help='Các CACHE_MAX_SIZE cần thử, phân cách bằng dấu phẩy')
+    parser.add_argument('--max-bytes', type=int, default=0, help='RESPONSE_CACHE_MAX_BYTES (0 = tắt)')
+    args = parser.parse_args()
+    if not args.paths and not args.s3:
+        parser.error('cần ít nhất một đường dẫn log hoặc --s3')
+
+    # Chỉ so sánh L1: tắt semantic tier, L2 và TTL
+    settings.RESPONSE_CACHE_SEMANTIC_ENABLED = False
+    cache.shared_backend = None
+    cache.CACHE_TTL_SECONDS = float('inf')
+
+    requests = load_requests(args)
+    if not requests:
+        print("Không có event nào có 'message' trong log")
+        sys.exit(1)
+    unique = len({cache.get_cache_key(m, c) for m, c, _ in requests})
+    print(f"Requests: {len(requests)}, unique keys: {unique}")
+    print(f"{'size':>8} {'policy':>8} {'hit rate':>9} {'us/req':>8}")
+    for size in (int(s) for s in args.sizes.split(',') if s.strip()):
+        for policy in ('lru', 'tinylfu'):
+            r = replay(requests, policy, size, args.max_bytes)
+            print(f"{size:>8} {policy:>8} {r['hit_rate']:>9.2%} {r['us_per_request']:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
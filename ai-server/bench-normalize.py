@@ -0,0 +1,103 @@
+"""
+Microbenchmark normalize_text: so sánh cài đặt gốc (NFD + regex) với bảng translate + memo LRU
+Chạy: python bench-normalize.py chat-logs/ [--s3] [--repeat 3] [--codepoints]
+
+Corpus là các trường message/response/context trong chat logs (.ndjson, .ndjson.gz hoặc S3).
+Script kiểm tra output giống hệt cài đặt gốc trên toàn corpus (exit 1 nếu có khác biệt) rồi đo thời gian.
+"""
+import argparse
+import sys
+import time
+
+from server.s3_logs import iter_local_events, list_log_objects, open_log_events
+from server.utils import _normalize_fast, _normalize_memo, normalize_text, normalize_text_reference
+
+FIELDS = ('message', 'response', 'context')
+
+
+def load_corpus(args):
+    if args.s3:
+        events = (ev for obj in list_log_objects() for ev in open_log_events(obj['Key'])[0])
+    else:
+        events = (ev for path in args.paths for ev in iter_local_events(path))
+    corpus = []
+    for ev in events:
+        for field in FIELDS:
+            value = ev.get(field)
+            if isinstance(value, str) and value:
+                corpus.append(value)
+    return corpus
+
+
+def check_identical(corpus) -> int:
+    mismatches = 0
+    for text in corpus:
+        expected = normalize_text_reference(text)
+        if normalize_text(text) != expected or _normalize_fast(text) != expected:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  MISMATCH: {text[:80]!r}")
+    return mismatches
+
+
+def check_codepoints() -> int:
+    """Mỗi code point (trừ surrogate) đặt giữa ngữ cảnh chữ/dấu câu phải cho cùng kết quả."""
+    mismatches = 0
+    for code in range(sys.maxunicode + 1):
+        if 0xD800 <= code <= 0xDFFF:
+            continue
+        ch = chr(code)
+        text = f"Ab {ch}x.{ch}"
+        if _normalize_fast(text) != normalize_text_reference(text):
+            mismatches += 1
+    return mismatches
+
+
+def timed(fn, corpus, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in corpus:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check and benchmark normalize_text against the reference implementation')
+    parser.add_argument('paths', nargs='*', help='File/thư mục .ndjson hoặc .ndjson.gz')
+    parser.add_argument('--s3', action='store_true', help='Đọc chat-logs trực tiếp từ S3 (AWS_S3_BUCKET)')
+    parser.add_argument('--repeat', type=int, default=3, help='Số lần đo, lấy lần nhanh nhất')
+    parser.add_argument('--codepoints', action='store_true', help='Kiểm tra thêm toàn bộ Unicode code points')
+    args = parser.parse_args()
+    if not args.paths and not args.s3:
+        parser.error('cần ít nhất một đường dẫn log hoặc --s3')
+
+    corpus = load_corpus(args)
+    if not corpus:
+        print("Corpus rỗng")
+        sys.exit(1)
+    print(f"Corpus: {len(corpus)} strings, {len(set(corpus))} unique, {sum(map(len, corpus))} chars")
+
+    mismatches = check_identical(corpus)
+    print(f"Identical output: {'OK' if not mismatches else f'{mismatches} mismatches'}")
+    if args.codepoints:
+        cp_mismatches = check_codepoints()
+        print(f"Code points: {'OK' if not cp_mismatches else f'{cp_mismatches} mismatches'}")
+        mismatches += cp_mismatches
+    if mismatches:
+        sys.exit(1)
+
+    reference = timed(normalize_text_reference, corpus, args.repeat)
+    fast = timed(_normalize_fast, corpus, args.repeat)
+    _normalize_memo.cache_clear()
+    memo = timed(normalize_text, corpus, args.repeat)
+    n = len(corpus)
+    print(f"{'impl':>12} {'total ms':>10} {'us/call':>8} {'speedup':>8}")
+    for name, elapsed in (('reference', reference), ('translate', fast), ('memo', memo)):
+        print(f"{name:>12} {elapsed * 1000:>10.1f} {elapsed / n * 1e6:>8.2f} {reference / elapsed:>7.1f}x")
+    print(f"Memo: {_normalize_memo.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,6 @@ Tự học chủ động - Tự động phân tích và học từ conversations
 Không cần feedback từ người dùng, AI tự phân tích để cải thiện
 """
 
-import json
 import re
 import threading
 import time
@@ -12,7 +11,8 @@ from typing import Optional, List, Dict
 from difflib import SequenceMatcher
 
 from . import settings
-from .kb import qa_knowledge_base, kb_lock, load_qa_knowledge_base
+from .kb import get_snapshot, load_qa_knowledge_base, upsert_items
+from .s3_logs import list_log_objects, fetch_objects, open_log_events
 from .utils import normalize_text
 
 
@@ -125,14 +125,13 @@ def calculate_qa_score(question: str, answer: str, source: str = '') -> float:
         score += 0.15
     
     # 7. Trừ điểm nếu quá giống với Q&A hiện có (duplicate)
-    with kb_lock:
-        for existing in qa_knowledge_base[:50]:  # Chỉ check 50 câu đầu
-            q_sim = SequenceMatcher(None, q, existing['q'].strip().lower()).ratio()
-            a_sim = SequenceMatcher(None, a.lower(), existing['a'].lower()).ratio()
-            if q_sim > 0.9 and a_sim > 0.8:  # Quá giống
-                return -1.0
-            elif q_sim > 0.85:  # Hơi giống
-                score -= 0.1
+    for existing in get_snapshot().items[:50]:  # Chỉ check 50 câu đầu
+        q_sim = SequenceMatcher(None, q, existing.q.strip().lower()).ratio()
+        a_sim = SequenceMatcher(None, a.lower(), existing.a.lower()).ratio()
+        if q_sim > 0.9 and a_sim > 0.8:  # Quá giống
+            return -1.0
+        elif q_sim > 0.85:  # Hơi giống
+            score -= 0.1
     
     return min(1.0, max(0.0, score))
 
@@ -142,20 +141,42 @@ def is_duplicate(question: str, answer: str, threshold: float = 0.85) -> bool:
     q = normalize_text(question)
     a = normalize_text(answer)
     
-    with kb_lock:
-        for item in qa_knowledge_base:
-            q_existing = normalize_text(item['q'])
-            a_existing = normalize_text(item['a'])
-            
-            q_sim = SequenceMatcher(None, q, q_existing).ratio()
-            a_sim = SequenceMatcher(None, a, a_existing).ratio()
-            
-            if q_sim >= threshold and a_sim >= threshold:
-                return True
+    for item in get_snapshot().items:
+        # Dùng dạng chuẩn hóa đã tính sẵn khi item được thêm vào KB
+        q_sim = SequenceMatcher(None, q, item.norm_q).ratio()
+        a_sim = SequenceMatcher(None, a, item.norm_a).ratio()
+        
+        if q_sim >= threshold and a_sim >= threshold:
+            return True
     
     return False
 
 
+def _load_s3_conversations(key: str) -> List[Dict]:
+    """Đọc stream một file chat log trên S3 và lấy các conversations cần phân tích."""
+    events, _nbytes = open_log_events(key)
+    conversations = []
+    for ev in events:
+        try:
+            msg = ev.get('message', '').strip()
+            ans = ev.get('response', '').strip()
+            source = ev.get('source', '').strip()
+            if msg and ans:
+                source_lower = (source or '').lower()
+                if ('feedback' not in source_lower and 
+                    'corrected' not in source_lower and
+                    'auto-learned' not in source_lower):
+                    conversations.append({
+                        'message': msg,
+                        'response': ans,
+                        'source': source,
+                        'timestamp': ev.get('timestamp', '')
+                    })
+        except Exception:
+            continue
+    return conversations
+
+
 def analyze_and_learn_from_conversations() -> Dict:
     """
     Tự động phân tích conversations từ AWS và học các Q&A chất lượng cao.
@@ -225,42 +246,13 @@ def analyze_and_learn_from_conversations() -> Dict:
             except Exception as e:
                 print(f"[WARN][Auto-learning][DDB] {e}")
         
-        # Lấy conversations từ S3 (toàn bộ file để học đầy đủ)
+        # Lấy conversations từ S3 (toàn bộ file để học đầy đủ, tải song song)
         if settings.s3_client and settings.AWS_S3_BUCKET:
             try:
-                prefix = f"{settings.LEARNING_S3_PREFIX}/"
-                paginator = settings.s3_client.get_paginator('list_objects_v2')
-                pages = paginator.paginate(Bucket=settings.AWS_S3_BUCKET, Prefix=prefix)
-                for page in pages:
-                    for obj in page.get('Contents', []):
-                        key = obj.get('Key', '')
-                        if not key.endswith('.ndjson'):
-                            continue
-                        try:
-                            s3_obj = settings.s3_client.get_object(Bucket=settings.AWS_S3_BUCKET, Key=key)
-                            body = s3_obj['Body'].read().decode('utf-8')
-                            lines = [ln for ln in body.strip().split('\n') if ln.strip()]
-                            for ln in lines:
-                                try:
-                                    ev = json.loads(ln)
-                                    msg = ev.get('message', '').strip()
-                                    ans = ev.get('response', '').strip()
-                                    source = ev.get('source', '').strip()
-                                    if msg and ans:
-                                        source_lower = (source or '').lower()
-                                        if ('feedback' not in source_lower and 
-                                            'corrected' not in source_lower and
-                                            'auto-learned' not in source_lower):
-                                            conversations_to_analyze.append({
-                                                'message': msg,
-                                                'response': ans,
-                                                'source': source,
-                                                'timestamp': ev.get('timestamp', '')
-                                            })
-                                except Exception:
-                                    continue
-                        except Exception:
-                            continue
+                keys = [obj['Key'] for obj in list_log_objects()]
+                for _key, conversations, error in fetch_objects(keys, _load_s3_conversations):
+                    if error is None:
+                        conversations_to_analyze.extend(conversations)
             except Exception:
                 pass
         
@@ -287,14 +279,8 @@ def analyze_and_learn_from_conversations() -> Dict:
         
         # Thêm vào knowledge base
         if top_items:
-            with kb_lock:
-                existing_questions = {item['q'].strip().lower() for item in qa_knowledge_base}
-                for item in top_items:
-                    q_key = item['q'].strip().lower()
-                    if q_key not in existing_questions:
-                        qa_knowledge_base.append({'q': item['q'], 'a': item['a']})
-                        learned_count += 1
-                        existing_questions.add(q_key)
+            # Một snapshot mới cho cả lô, bỏ qua các câu hỏi đã có trong KB
+            learned_count = upsert_items([(item['q'], item['a']) for item in top_items], overwrite=False)
         
         auto_learned_count += learned_count
         last_analysis_time = datetime.now()
@@ -3,20 +3,68 @@ Response Caching - Cache các câu trả lời để giảm API calls
 """
 
 import hashlib
+import heapq
+import math
 import threading
 import time
-from datetime import datetime, timedelta
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterable, List, Sequence, Tuple
 from collections import OrderedDict
-from .utils import normalize_text
+from . import settings
+from .cache_admission import create_admission
+from .cache_backends import create_backend
+from .utils import normalize_text, tokenize_normalized
 
 # LRU Cache in-memory
 response_cache: OrderedDict[str, Dict] = OrderedDict()
 cache_lock = threading.Lock()
 
+# Token -> cache keys (mọi context), để tìm gần đúng theo tập tokens (tier semantic, invalidate)
+token_index: Dict[str, set] = {}
+
+# Câu hỏi đã chuẩn hóa -> cache keys: message của entry và câu hỏi KB đã tạo ra câu trả lời,
+# để KB thay đổi chỉ invalidate đúng các entry liên quan
+question_index: Dict[str, set] = {}
+
+# Số entry theo nguồn câu trả lời (kb/ollama/gemini/...)
+source_counts: Dict[str, int] = {}
+
+# Version snapshot KB mới nhất đã publish: câu trả lời tính trên snapshot cũ hơn (KB đổi giữa lúc
+# tra cứu và lúc cache) không được ghi vào cache
+kb_version_floor = 0
+
+# Min-heap (expires_at, key) để dọn entry hết hạn; entry đã bị xóa/ghi đè bỏ qua khi pop (lazy deletion)
+expiry_heap: List[Tuple[float, str]] = []
+
 # Config
 CACHE_MAX_SIZE = 1000  # Tối đa 1000 cached responses
-CACHE_TTL_SECONDS = 3600  # Cache valid trong 1 giờ
+CACHE_MAX_BYTES = settings.RESPONSE_CACHE_MAX_BYTES  # Ngân sách bytes (UTF-8) của các response, 0 = không giới hạn
+CACHE_TTL_SECONDS = settings.RESPONSE_CACHE_TTL  # Mặc định cache valid trong 1 giờ
+SWEEP_INTERVAL_SECONDS = settings.RESPONSE_CACHE_SWEEP_INTERVAL  # Chu kỳ background sweeper
+SWEEP_BATCH_SIZE = max(1, settings.RESPONSE_CACHE_SWEEP_BATCH)  # Số entry tối đa xóa mỗi lần giữ lock
+INVALIDATE_BATCH_SIZE = 256  # Số câu hỏi tối đa xử lý mỗi lần giữ lock khi invalidate
+
+# L2 dùng chung giữa các worker process (None = chỉ dùng L1 trong process)
+shared_backend = create_backend()
+
+# Admission policy cho L1 (None = LRU thuần, luôn nhận entry mới)
+admission = create_admission(CACHE_MAX_SIZE)
+
+# Stats theo tier
+_stats = {
+    'exact_hits': 0,
+    'exact_misses': 0,
+    'shared_hits': 0,
+    'shared_misses': 0,
+    'shared_errors': 0,
+    'semantic_hits': 0,
+    'semantic_misses': 0,
+    'expired_evictions': 0,
+    'lru_evictions': 0,
+    'oversize_skips': 0,
+    'bytes_used': 0,
+    'invalidations': 0,
+    'stale_kb_skips': 0,
+}
 
 
 def _generate_cache_key(message: str, context: str = "") -> str:
@@ -27,56 +75,360 @@ def _generate_cache_key(message: str, context: str = "") -> str:
     return hashlib.md5(combined.encode('utf-8')).hexdigest()
 
 
-def get_cached_response(message: str, context: str = "") -> Optional[str]:
+def get_cache_key(message: str, context: str = "") -> str:
+    """Cache key của (message, context), dùng chung cho các tầng khác (vd. gộp request in-flight)."""
+    return _generate_cache_key(message, context)
+
+
+def _context_partition(context: str) -> str:
+    """Partition của semantic tier: chỉ so khớp gần đúng giữa các message cùng context."""
+    return hashlib.md5(normalize_text(context).encode('utf-8')).hexdigest()
+
+
+def _is_fresh(item: Dict, now: float) -> bool:
+    return now < item['expires_at']
+
+
+def _remove_entry(cache_key: str) -> None:
+    """Xóa entry khỏi LRU và các index (gọi khi giữ cache_lock)."""
+    item = response_cache.pop(cache_key, None)
+    if item is None:
+        return
+    _stats['bytes_used'] -= item['size']
+    source_counts[item['source']] -= 1
+    for question in item['questions']:
+        keys = question_index.get(question)
+        if keys is not None:
+            keys.discard(cache_key)
+            if not keys:
+                del question_index[question]
+    for tok in item['tokens']:
+        keys = token_index.get(tok)
+        if keys is not None:
+            keys.discard(cache_key)
+            if not keys:
+                del token_index[tok]
+
+
+def _semantic_lookup(tokens: frozenset, partition_key: str, now: float) -> Optional[str]:
+    """
+    Tìm entry còn hạn trong cùng partition có Jaccard(tokens) cao nhất và
+    >= RESPONSE_CACHE_SEMANTIC_THRESHOLD (gọi khi giữ cache_lock). Trả về cache key hoặc None.
+
+    Jaccard không xét thứ tự và câu dài vẫn đạt ngưỡng khi thay một từ ("thêm" -> "xóa"),
+    nên hai tập tokens còn phải khác nhau không quá RESPONSE_CACHE_SEMANTIC_MAX_DIFF token.
+    """
+    if not tokens:
+        return None
+    candidates = set()
+    for tok in tokens:
+        candidates.update(token_index.get(tok, ()))
+
+    best_key = None
+    best_score = 0.0
+    for key in candidates:
+        item = response_cache.get(key)
+        if item is None or item['partition'] != partition_key or not _is_fresh(item, now):
+            continue
+        other = item['tokens']
+        if len(tokens ^ other) > settings.RESPONSE_CACHE_SEMANTIC_MAX_DIFF:
+            continue
+        score = len(tokens & other) / len(tokens | other)
+        if score > best_score:
+            best_key, best_score = key, score
+    if best_score >= settings.RESPONSE_CACHE_SEMANTIC_THRESHOLD:
+        return best_key
+    return None
+
+
+def _evict_expired(now: float, limit: int) -> int:
+    """Xóa tối đa `limit` entry đã hết hạn theo thứ tự expires_at (gọi khi giữ cache_lock)."""
+    removed = 0
+    while expiry_heap and expiry_heap[0][0] <= now and removed < limit:
+        expires_at, key = heapq.heappop(expiry_heap)
+        item = response_cache.get(key)
+        # Bỏ qua mục heap cũ của entry đã bị xóa hoặc ghi đè
+        if item is not None and item['expires_at'] == expires_at:
+            _remove_entry(key)
+            _stats['expired_evictions'] += 1
+            removed += 1
+    return removed
+
+
+def _over_capacity(extra_items: int = 0, extra_bytes: int = 0) -> bool:
+    if len(response_cache) + extra_items > CACHE_MAX_SIZE:
+        return True
+    return CACHE_MAX_BYTES > 0 and _stats['bytes_used'] + extra_bytes > CACHE_MAX_BYTES
+
+
+def _admit(cache_key: str, size: int) -> bool:
     """
-    Lấy cached response nếu có.
+    TinyLFU: entry mới chỉ được nhận nếu tần suất của nó lớn hơn mọi LRU victim
+    phải đẩy ra để có chỗ (gọi khi giữ cache_lock).
+    """
+    freq = admission.frequency(cache_key)
+    items = len(response_cache) + 1
+    used = _stats['bytes_used'] + size
+    for key, item in response_cache.items():  # Từ LRU (cũ nhất) trở đi
+        if items <= CACHE_MAX_SIZE and (CACHE_MAX_BYTES <= 0 or used <= CACHE_MAX_BYTES):
+            break
+        if admission.frequency(key) >= freq:
+            return False
+        items -= 1
+        used -= item['size']
+    return True
+
+
+def _insert_entry(
+    cache_key: str,
+    response: str,
+    created_at: float,
+    partition_key: str,
+    tokens: frozenset,
+    chunk_ends: Optional[Tuple[int, ...]] = None,
+    source: str = 'unknown',
+    kb_version: Optional[int] = None,
+    questions: Tuple[str, ...] = (),
+) -> None:
+    """Thêm entry vào L1 và các index, evict nếu vượt max size/max bytes (gọi khi giữ cache_lock)."""
+    if kb_version is not None and kb_version < kb_version_floor:
+        _stats['stale_kb_skips'] += 1
+        return
     
-    Returns:
-        Cached response hoặc None nếu không có/đã hết hạn
+    # Remove nếu đã tồn tại (cập nhật entry cũ không cần qua admission)
+    existing = cache_key in response_cache
+    _remove_entry(cache_key)
+    
+    size = len(response.encode('utf-8'))
+    if CACHE_MAX_BYTES > 0 and size > CACHE_MAX_BYTES:
+        # Một response lớn hơn cả ngân sách: không cache ở L1
+        _stats['oversize_skips'] += 1
+        return
+    
+    if _over_capacity(1, size):
+        # Entry hết hạn nhường chỗ trước, sau đó mới xét admission/LRU
+        now = time.time()
+        while _over_capacity(1, size) and _evict_expired(now, 1):
+            pass
+        if admission is not None and not existing and _over_capacity(1, size):
+            if not _admit(cache_key, size):
+                admission.rejected += 1
+                return
+            admission.admitted += 1
+    
+    # Thêm mới
+    expires_at = created_at + CACHE_TTL_SECONDS
+    response_cache[cache_key] = {
+        'response': response,
+        'expires_at': expires_at,
+        'partition': partition_key,
+        'tokens': tokens,
+        'size': size,
+        'chunk_ends': chunk_ends,
+        'source': source,
+        'kb_version': kb_version,
+        'questions': questions,
+    }
+    _stats['bytes_used'] += size
+    source_counts[source] = source_counts.get(source, 0) + 1
+    for question in questions:
+        question_index.setdefault(question, set()).add(cache_key)
+    heapq.heappush(expiry_heap, (expires_at, cache_key))
+    # Heap chứa quá nhiều mục cũ thì dựng lại từ các entry còn sống
+    if len(expiry_heap) > 2 * len(response_cache) + CACHE_MAX_SIZE:
+        expiry_heap[:] = [(item['expires_at'], key) for key, item in response_cache.items()]
+        heapq.heapify(expiry_heap)
+    for tok in tokens:
+        token_index.setdefault(tok, set()).add(cache_key)
+    
+    # LRU: Xóa oldest nếu quá max size/max bytes
+    while _over_capacity():
+        _remove_entry(next(iter(response_cache)))  # Remove oldest
+        _stats['lru_evictions'] += 1
+
+
+def _lookup(
+    message: str,
+    context: str,
+    exact: bool = True,
+    shared: bool = True,
+    semantic: bool = True,
+    kb_version: Optional[int] = None,
+) -> Optional[Dict]:
+    """
+    Tra cứu cache, trả về entry L1 ({'response', 'chunk_ends', ...}) hoặc None.
+
+    Thứ tự tra cứu (mỗi tier bật/tắt bằng tham số cùng tên):
+        1. exact: L1 (trong process) so khớp chính xác theo cache key
+        2. shared: L2 dùng chung (nếu cấu hình RESPONSE_CACHE_BACKEND), hit thì nạp lại vào L1
+        3. semantic: message gần giống nhất trong cùng context ở L1
+
+    L2 được ghi bởi mọi worker và không biết KB của process này, nên chỉ nên tra sau khi KB (version
+    `kb_version`) không trả lời được message; hit được gắn version đó, bỏ qua nếu KB đã đổi.
     """
     cache_key = _generate_cache_key(message, context)
+    now = time.time()
+    
+    if exact:
+        with cache_lock:
+            if admission is not None:
+                admission.record(cache_key)
+            if cache_key in response_cache:
+                cached_item = response_cache[cache_key]
+                
+                # Kiểm tra TTL
+                if _is_fresh(cached_item, now):
+                    # Move to end (LRU)
+                    response_cache.move_to_end(cache_key)
+                    _stats['exact_hits'] += 1
+                    return cached_item
+                else:
+                    # Expired, remove
+                    _remove_entry(cache_key)
+            _stats['exact_misses'] += 1
     
+    # L2: truy cập ngoài cache_lock để I/O không chặn các request khác
+    if shared and shared_backend is not None:
+        partition_key = _context_partition(context)
+        norm_message = normalize_text(message)
+        tokens = frozenset(tokenize_normalized(norm_message))
+        try:
+            shared_item = shared_backend.get(cache_key)
+        except Exception as e:
+            shared_item = None
+            _stats['shared_errors'] += 1
+            print(f"[WARN][Cache][L2] get failed: {e}")
+        with cache_lock:
+            if shared_item is not None and kb_version is not None and kb_version < kb_version_floor:
+                # KB đã publish version mới sau lúc tra KB: không chắc message vẫn chưa có trong KB
+                _stats['stale_kb_skips'] += 1
+                shared_item = None
+            if shared_item is not None:
+                _insert_entry(
+                    cache_key, shared_item['response'], shared_item['created_at'], partition_key, tokens,
+                    source='shared', kb_version=kb_version, questions=(norm_message,),
+                )
+                _stats['shared_hits'] += 1
+                # Entry có thể không được nhận vào L1 (admission/byte budget)
+                return {'response': shared_item['response'], 'chunk_ends': None}
+            _stats['shared_misses'] += 1
+    
+    if not semantic or not settings.RESPONSE_CACHE_SEMANTIC_ENABLED:
+        return None
+    partition_key = _context_partition(context)
+    tokens = frozenset(tokenize_normalized(normalize_text(message)))
     with cache_lock:
-        if cache_key in response_cache:
-            cached_item = response_cache[cache_key]
-            
-            # Kiểm tra TTL
-            if datetime.now() - cached_item['timestamp'] < timedelta(seconds=CACHE_TTL_SECONDS):
-                # Move to end (LRU)
-                response_cache.move_to_end(cache_key)
-                return cached_item['response']
-            else:
-                # Expired, remove
-                del response_cache[cache_key]
+        similar_key = _semantic_lookup(tokens, partition_key, now)
+        if similar_key is None:
+            _stats['semantic_misses'] += 1
+            return None
+        response_cache.move_to_end(similar_key)
+        _stats['semantic_hits'] += 1
+        return response_cache[similar_key]
+
+
+def get_cached_response(
+    message: str,
+    context: str = "",
+    exact: bool = True,
+    shared: bool = True,
+    semantic: bool = True,
+    kb_version: Optional[int] = None,
+) -> Optional[str]:
+    """
+    Lấy cached response nếu có (xem _lookup về thứ tự tra cứu và các tham số).
     
-    return None
+    Returns:
+        Cached response hoặc None nếu không có/đã hết hạn
+    """
+    item = _lookup(message, context, exact, shared, semantic, kb_version)
+    return item['response'] if item is not None else None
 
 
-def cache_response(message: str, context: str, response: str) -> None:
+def get_cached_chunks(
+    message: str,
+    context: str = "",
+    exact: bool = True,
+    shared: bool = True,
+    semantic: bool = True,
+    kb_version: Optional[int] = None,
+) -> Optional[List[str]]:
+    """
+    Lấy cached response dưới dạng các chunk như lúc được stream.
+    Entry không có ranh giới chunk (KB, L2, response không stream) trả về một chunk duy nhất.
     """
-    Cache response.
+    return _item_chunks(_lookup(message, context, exact, shared, semantic, kb_version))
+
+
+def _item_chunks(item: Optional[Dict]) -> Optional[List[str]]:
+    if item is None:
+        return None
+    response = item['response']
+    chunk_ends = item.get('chunk_ends')
+    if not chunk_ends:
+        return [response]
+    chunks = []
+    start = 0
+    for end in chunk_ends:
+        chunks.append(response[start:end])
+        start = end
+    return chunks
+
+
+def cache_response(
+    message: str,
+    context: str,
+    response: str,
+    chunks: Optional[Sequence[str]] = None,
+    source: str = 'unknown',
+    kb_version: Optional[int] = None,
+    kb_question: Optional[str] = None,
+) -> None:
+    """
+    Cache response (ghi vào L1 và L2 nếu có).
     
     Args:
         message: User message
         context: Context
         response: AI response
+        chunks: Các chunk đã stream; lưu ranh giới nếu ghép lại đúng bằng response
+        source: Nguồn câu trả lời ('kb', 'ollama', 'gemini', ...)
+        kb_version: Version snapshot KB lúc tra cứu (KB đã khớp, hoặc không khớp nên phải gọi model);
+            bỏ qua nếu KB đã publish version mới hơn
+        kb_question: Câu hỏi KB đã khớp (source 'kb'), để invalidate khi KB thay đổi
     """
     cache_key = _generate_cache_key(message, context)
+    partition_key = _context_partition(context)
+    norm_message = normalize_text(message)
+    tokens = frozenset(tokenize_normalized(norm_message))
+    questions = {norm_message}
+    if kb_question:
+        questions.add(normalize_text(kb_question))
+    now = time.time()
+    
+    chunk_ends = None
+    if chunks:
+        ends = []
+        offset = 0
+        for chunk in chunks:
+            offset += len(chunk)
+            ends.append(offset)
+        if offset == len(response):
+            chunk_ends = tuple(ends)
     
     with cache_lock:
-        # Remove nếu đã tồn tại
-        if cache_key in response_cache:
-            del response_cache[cache_key]
-        
-        # Thêm mới
-        response_cache[cache_key] = {
-            'response': response,
-            'timestamp': datetime.now()
-        }
-        
-        # LRU: Xóa oldest nếu quá max size
-        while len(response_cache) > CACHE_MAX_SIZE:
-            response_cache.popitem(last=False)  # Remove oldest
+        if kb_version is not None and kb_version < kb_version_floor:
+            _stats['stale_kb_skips'] += 1
+            return
+        _insert_entry(cache_key, response, now, partition_key, tokens, chunk_ends, source, kb_version, tuple(questions))
+    
+    # Câu trả lời KB tra lại rất rẻ và phụ thuộc KB của từng process -> chỉ giữ ở L1
+    if shared_backend is not None and source != 'kb':
+        try:
+            shared_backend.set(cache_key, response, now)
+        except Exception as e:
+            _stats['shared_errors'] += 1
+            print(f"[WARN][Cache][L2] set failed: {e}")
 
 
 def clear_cache() -> int:
@@ -89,24 +441,181 @@ def clear_cache() -> int:
     with cache_lock:
         count = len(response_cache)
         response_cache.clear()
+        token_index.clear()
+        expiry_heap.clear()
+        question_index.clear()
+        source_counts.clear()
+        _stats['bytes_used'] = 0
+        if admission is not None:
+            admission.clear()
+    if shared_backend is not None:
+        try:
+            count = max(count, shared_backend.clear())
+        except Exception as e:
+            print(f"[WARN][Cache][L2] clear failed: {e}")
     return count
 
 
+def _min_overlap(size: int) -> int:
+    """Số token chung tối thiểu để một tập `size` tokens gần một tập khác theo tiêu chí của tier semantic."""
+    by_jaccard = math.ceil(size * settings.RESPONSE_CACHE_SEMANTIC_THRESHOLD - 1e-9)
+    return max(1, min(by_jaccard, size - settings.RESPONSE_CACHE_SEMANTIC_MAX_DIFF))
+
+
+def _similar_keys(tokens: frozenset) -> set:
+    """
+    Các entry (mọi context) có tập tokens gần `tokens` theo tiêu chí của tier semantic (Jaccard
+    >= ngưỡng hoặc lệch không quá RESPONSE_CACHE_SEMANTIC_MAX_DIFF token) - gọi khi giữ cache_lock.
+
+    Entry gần `tokens` phải có ít nhất m = _min_overlap token chung, nên chứa ít nhất một trong
+    (len - m + 1) token hiếm nhất của `tokens`: chỉ cần duyệt các posting list ngắn đó.
+    """
+    keys = set()
+    if not tokens:
+        return keys
+    size = len(tokens)
+    max_diff = settings.RESPONSE_CACHE_SEMANTIC_MAX_DIFF
+    threshold = settings.RESPONSE_CACHE_SEMANTIC_THRESHOLD
+    prefix = size - _min_overlap(size) + 1
+    candidates = set()
+    for tok in sorted(tokens, key=lambda t: len(token_index.get(t, ())))[:prefix]:
+        candidates.update(token_index.get(tok, ()))
+    for key in candidates:
+        other = response_cache[key]['tokens']
+        # Lọc nhanh theo số token: lệch > max_diff và Jaccard <= min/max thì không thể gần nhau
+        if abs(len(other) - size) > max_diff and min(len(other), size) < threshold * max(len(other), size):
+            continue
+        if len(tokens ^ other) <= max_diff or len(tokens & other) / len(tokens | other) >= threshold:
+            keys.add(key)
+    return keys
+
+
+def invalidate_questions(
+    questions: Iterable[str],
+    kb_version: Optional[int] = None,
+    near_duplicates: bool = True,
+) -> int:
+    """
+    Xóa các entry có message hoặc câu hỏi KB nguồn thuộc `questions`, cùng các entry có message gần
+    giống các câu hỏi đó (L1 và L2). Dùng khi KB thêm/sửa/xóa Q&A thay vì xóa toàn bộ cache.
+    Xử lý theo batch INVALIDATE_BATCH_SIZE câu hỏi, nhả cache_lock giữa các batch để không chặn tra cứu.
+
+    Args:
+        questions: Các câu hỏi KB đã thay đổi
+        kb_version: Version snapshot KB vừa publish; từ đó câu trả lời tính trên snapshot cũ bị bỏ qua
+        near_duplicates: Có xóa cả entry gần giống không (bỏ qua được khi KB trước đó rỗng,
+            vd. lần load đầu, lúc mọi câu hỏi đều "thay đổi")
+
+    Returns:
+        Số entry L1 đã xóa
+    """
+    global kb_version_floor
+    normalized = list({normalize_text(question) for question in questions})
+    removed = []
+    with cache_lock:
+        if kb_version is not None:
+            kb_version_floor = max(kb_version_floor, kb_version)
+    for start in range(0, len(normalized), INVALIDATE_BATCH_SIZE):
+        with cache_lock:
+            if not response_cache:
+                break
+            keys = set()
+            for question in normalized[start:start + INVALIDATE_BATCH_SIZE]:
+                keys.update(question_index.get(question, ()))
+                if near_duplicates:
+                    keys.update(_similar_keys(frozenset(tokenize_normalized(question))))
+            for key in keys:
+                _remove_entry(key)
+            _stats['invalidations'] += len(keys)
+        removed.extend(keys)
+    if shared_backend is not None:
+        for key in removed:
+            try:
+                shared_backend.delete(key)
+            except Exception as e:
+                print(f"[WARN][Cache][L2] delete failed: {e}")
+                break
+    return len(removed)
+
+
 def get_cache_stats() -> Dict:
     """Lấy thống kê cache."""
     with cache_lock:
-        now = datetime.now()
-        valid_count = sum(
-            1 for item in response_cache.values()
-            if now - item['timestamp'] < timedelta(seconds=CACHE_TTL_SECONDS)
-        )
-        expired_count = len(response_cache) - valid_count
-        
-        return {
+        # O(1): không duyệt entry; entry hết hạn bị sweeper xóa trong vòng SWEEP_INTERVAL_SECONDS
+        # và không bao giờ được trả về khi tra cứu
+        stats = {
             'total_items': len(response_cache),
-            'valid_items': valid_count,
-            'expired_items': expired_count,
             'max_size': CACHE_MAX_SIZE,
-            'ttl_seconds': CACHE_TTL_SECONDS
+            'bytes_used': _stats['bytes_used'],
+            'max_bytes': CACHE_MAX_BYTES,
+            'oversize_skips': _stats['oversize_skips'],
+            'invalidations': _stats['invalidations'],
+            'stale_kb_skips': _stats['stale_kb_skips'],
+            'kb_version': kb_version_floor,
+            'by_source': {source: n for source, n in source_counts.items() if n},
+            'admission': admission.stats() if admission is not None else {'policy': 'lru'},
+            'ttl_seconds': CACHE_TTL_SECONDS,
+            'expired_evictions': _stats['expired_evictions'],
+            'lru_evictions': _stats['lru_evictions'],
+            'tiers': {
+                'exact': {
+                    'hits': _stats['exact_hits'],
+                    'misses': _stats['exact_misses'],
+                },
+                'shared': {
+                    'backend': settings.RESPONSE_CACHE_BACKEND if shared_backend is not None else 'memory',
+                    'hits': _stats['shared_hits'],
+                    'misses': _stats['shared_misses'],
+                    'errors': _stats['shared_errors'],
+                },
+                'semantic': {
+                    'enabled': settings.RESPONSE_CACHE_SEMANTIC_ENABLED,
+                    'threshold': settings.RESPONSE_CACHE_SEMANTIC_THRESHOLD,
+                    'max_diff': settings.RESPONSE_CACHE_SEMANTIC_MAX_DIFF,
+                    'hits': _stats['semantic_hits'],
+                    'misses': _stats['semantic_misses'],
+                },
+            }
         }
+    
+    if shared_backend is not None:
+        try:
+            stats['tiers']['shared'].update(shared_backend.stats())
+        except Exception as e:
+            print(f"[WARN][Cache][L2] stats failed: {e}")
+    return stats
+
+
+
+def sweep_expired() -> int:
+    """Xóa các entry hết hạn theo từng batch (nhả lock giữa các batch). Trả về số entry đã xóa."""
+    total = 0
+    while True:
+        with cache_lock:
+            removed = _evict_expired(time.time(), SWEEP_BATCH_SIZE)
+        total += removed
+        if removed < SWEEP_BATCH_SIZE:
+            break
+    if shared_backend is not None:
+        try:
+            shared_backend.purge_expired()
+        except Exception as e:
+            print(f"[WARN][Cache][L2] purge failed: {e}")
+    return total
+
+
+def start_sweeper_thread():
+    """Khởi động background thread dọn entry hết hạn."""
+    def sweeper_worker():
+        while True:
+            try:
+                time.sleep(SWEEP_INTERVAL_SECONDS)
+                sweep_expired()
+            except Exception as e:
+                print(f"[WARN][Cache][Sweeper] Error: {e}")
+    
+    thread = threading.Thread(target=sweeper_worker, daemon=True, name="CacheSweeper")
+    thread.start()
+
 
+start_sweeper_thread()
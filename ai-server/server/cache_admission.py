@@ -0,0 +1,101 @@
+"""
+Cache admission - Chính sách nhận entry mới cho response cache (TinyLFU)
+Count-min sketch ước lượng tần suất gần đây của từng cache key; entry mới chỉ được
+đẩy LRU victim ra nếu được hỏi nhiều hơn victim
+"""
+
+import hashlib
+from typing import Optional
+
+from . import settings
+
+
+class CountMinSketch:
+    """
+    Count-min sketch với counter 4-bit (tối đa 15), `depth` hàng x `width` cột.
+    Sau mỗi `sample_size` lần tăng, mọi counter bị chia đôi (aging) để tần suất cũ phai dần.
+    """
+
+    MAX_COUNT = 15
+
+    def __init__(self, width: int, depth: int = 4, sample_size: Optional[int] = None):
+        # Làm tròn width lên lũy thừa của 2 để lấy chỉ số bằng phép AND
+        self.width = 1 << max(4, (width - 1).bit_length())
+        self.mask = self.width - 1
+        self.depth = depth
+        self.rows = [bytearray(self.width) for _ in range(depth)]
+        self.sample_size = sample_size or 10 * self.width
+        self.additions = 0
+        self.resets = 0
+
+    def _indexes(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) & self.mask for i in range(self.depth)]
+
+    def estimate(self, key: str) -> int:
+        return min(row[i] for row, i in zip(self.rows, self._indexes(key)))
+
+    def increment(self, key: str) -> None:
+        indexes = self._indexes(key)
+        current = min(row[i] for row, i in zip(self.rows, indexes))
+        if current < self.MAX_COUNT:
+            # Conservative update: chỉ tăng các counter đang bằng giá trị nhỏ nhất
+            for row, i in zip(self.rows, indexes):
+                if row[i] == current:
+                    row[i] = current + 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._age()
+
+    def _age(self) -> None:
+        halve = bytes(c >> 1 for c in range(256))
+        for row in self.rows:
+            row[:] = row.translate(halve)
+        self.additions //= 2
+        self.resets += 1
+
+    def clear(self) -> None:
+        for row in self.rows:
+            row[:] = bytes(self.width)
+        self.additions = 0
+
+
+class TinyLFU:
+    """Admission TinyLFU: ghi nhận mỗi lần tra cứu, so sánh tần suất candidate với victim."""
+
+    name = 'tinylfu'
+
+    def __init__(self, capacity: int):
+        self.sketch = CountMinSketch(width=max(64, 4 * capacity))
+        self.admitted = 0
+        self.rejected = 0
+
+    def record(self, key: str) -> None:
+        self.sketch.increment(key)
+
+    def frequency(self, key: str) -> int:
+        return self.sketch.estimate(key)
+
+    def clear(self) -> None:
+        self.sketch.clear()
+
+    def stats(self) -> dict:
+        return {
+            'policy': self.name,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'sketch_width': self.sketch.width,
+            'sketch_resets': self.sketch.resets,
+        }
+
+
+def create_admission(capacity: int) -> Optional[TinyLFU]:
+    """Tạo admission policy theo settings.RESPONSE_CACHE_ADMISSION ('lru' = luôn nhận entry mới)."""
+    policy = settings.RESPONSE_CACHE_ADMISSION
+    if policy == 'tinylfu':
+        return TinyLFU(capacity)
+    if policy != 'lru':
+        print(f"[WARN][Cache] Unknown RESPONSE_CACHE_ADMISSION '{policy}', using plain LRU")
+    return None
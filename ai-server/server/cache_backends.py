@@ -0,0 +1,124 @@
+"""
+Cache backends - Tầng lưu trữ dùng chung (L2) cho response cache
+L1 là OrderedDict trong từng process (cache.py); L2 dùng chung giữa các worker trên cùng host
+"""
+
+import time
+from typing import Dict, Optional
+
+from . import settings
+from .sqlite_store import SQLitePool
+
+
+class CacheBackend:
+    """Interface cho L2 cache: get/set theo cache key với LRU + TTL."""
+
+    name = 'none'
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Trả về {'response': str, 'created_at': float (epoch)} hoặc None nếu không có/hết hạn."""
+        return None
+
+    def set(self, key: str, response: str, created_at: float) -> None:
+        pass
+
+    def delete(self, key: str) -> None:
+        pass
+
+    def clear(self) -> int:
+        return 0
+
+    def purge_expired(self) -> int:
+        """Xóa các entry đã hết TTL, trả về số entry đã xóa."""
+        return 0
+
+    def stats(self) -> Dict:
+        return {'backend': self.name}
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    L2 cache trên SQLite (WAL): nhiều worker process cùng đọc/ghi một file.
+    LRU theo last_access, TTL theo created_at, giống L1 trong process.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS response_cache (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_access REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_response_cache_last_access ON response_cache(last_access);
+    CREATE INDEX IF NOT EXISTS idx_response_cache_created_at ON response_cache(created_at);
+    """
+
+    def __init__(self, path: str, max_size: int, ttl_seconds: int):
+        self.db = SQLitePool(path, self.SCHEMA)
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        row = self.db.fetchone("SELECT response, created_at FROM response_cache WHERE key = ?", (key,))
+        if row is None:
+            return None
+        response, created_at = row
+        if now - created_at >= self.ttl_seconds:
+            self.db.execute("DELETE FROM response_cache WHERE key = ? AND created_at = ?", (key, created_at))
+            return None
+        self.db.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+        return {'response': response, 'created_at': created_at}
+
+    def set(self, key: str, response: str, created_at: float) -> None:
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, created_at, time.time()),
+            )
+            # LRU: xóa các entry ít dùng nhất nếu vượt max_size
+            (count,) = conn.execute("SELECT COUNT(*) FROM response_cache").fetchone()
+            if count > self.max_size:
+                conn.execute(
+                    "DELETE FROM response_cache WHERE key IN "
+                    "(SELECT key FROM response_cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_size,),
+                )
+
+    def delete(self, key: str) -> None:
+        self.db.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+
+    def clear(self) -> int:
+        return self.db.execute("DELETE FROM response_cache")
+
+    def purge_expired(self) -> int:
+        return self.db.execute("DELETE FROM response_cache WHERE created_at <= ?", (time.time() - self.ttl_seconds,))
+
+    def stats(self) -> Dict:
+        (count,) = self.db.fetchone("SELECT COUNT(*) FROM response_cache")
+        return {
+            'backend': self.name,
+            'path': self.db.path,
+            'items': count,
+            'max_size': self.max_size,
+        }
+
+
+def create_backend() -> Optional[CacheBackend]:
+    """Tạo L2 backend theo settings.RESPONSE_CACHE_BACKEND ('memory' = chỉ dùng L1)."""
+    backend = settings.RESPONSE_CACHE_BACKEND
+    if backend == 'sqlite':
+        try:
+            return SQLiteCacheBackend(
+                settings.RESPONSE_CACHE_SQLITE_PATH,
+                settings.RESPONSE_CACHE_SHARED_MAX_SIZE,
+                settings.RESPONSE_CACHE_TTL,
+            )
+        except Exception as e:
+            print(f"[WARN][Cache] Failed to open SQLite cache {settings.RESPONSE_CACHE_SQLITE_PATH}: {e}")
+            return None
+    if backend != 'memory':
+        print(f"[WARN][Cache] Unknown RESPONSE_CACHE_BACKEND '{backend}', using in-process cache only")
+    return None
@@ -0,0 +1,189 @@
+"""
+Cache warm-up - Nạp sẵn response cache từ chat logs lịch sử khi khởi động
+Chọn các cặp (message, response) được hỏi nhiều nhất từ S3/DynamoDB hoặc file ndjson local,
+chạy trong background thread nên không chặn server nhận request
+"""
+
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from . import cache, kb, settings
+from .s3_logs import fetch_objects, iter_local_events, list_log_objects, open_log_events
+
+# Chỉ warm các câu trả lời thật từ model; 'cache' có thể là câu trả lời KB đã cache (không gắn câu hỏi KB
+# để invalidate), 'kb'/'fallback'/'error'/action thì không cần hoặc không nên cache
+WARMUP_SOURCES = ('ollama', 'gemini')
+
+# Thời gian tối đa (giây) đợi lần load KB đầu tiên trước khi warm-up
+KB_READY_TIMEOUT = 120
+
+# DynamoDB chỉ lưu 2000 ký tự đầu của response (xem utils.persist_chat_event)
+DDB_RESPONSE_LIMIT = 2000
+
+warmup_status: Dict = {
+    'state': 'disabled',
+    'source': None,
+    'events_scanned': 0,
+    'candidates': 0,
+    'items_loaded': 0,
+    'kb_skips': 0,
+    'feedback_skips': 0,
+    'duration_ms': None,
+    'error': None,
+}
+
+# Kết quả đếm một nguồn: (số event đã đọc, tần suất theo cache key, cache key -> câu trả lời mới nhất).
+# Câu trả lời mới nhất là None nếu event sau cùng của cặp là feedback/correction
+Tally = Tuple[int, Counter, Dict[str, Optional[tuple]]]
+
+
+def _tally(events: Iterable[Dict]) -> Tally:
+    """Đếm tần suất (message, context) và giữ câu trả lời model mới nhất của từng cặp (đọc stream, không buffer)."""
+    counts: Counter = Counter()
+    latest: Dict[str, Optional[tuple]] = {}
+    scanned = 0
+    for ev in events:
+        scanned += 1
+        message = (ev.get('message') or '').strip()
+        if not message:
+            continue
+        context = ev.get('context') or ''
+        source = ev.get('source')
+        # Log đọc theo thứ tự cũ -> mới nên event sau ghi đè event trước
+        if kb.is_feedback_source(source):
+            # Câu trả lời đã được người dùng xác nhận/sửa (nằm trong KB): không warm câu trả lời model cũ
+            latest[cache.get_cache_key(message, context)] = None
+            continue
+        response = (ev.get('response') or '').strip()
+        if not response or source not in WARMUP_SOURCES:
+            continue
+        key = cache.get_cache_key(message, context)
+        counts[key] += 1
+        latest[key] = (message, context, response, source)
+    return scanned, counts, latest
+
+
+def _load_s3_tally(key: str) -> Tally:
+    events, _ = open_log_events(key)
+    return _tally(events)
+
+
+def _iter_ddb_events() -> Iterator[Dict]:
+    """Các chat event của RESPONSE_CACHE_WARMUP_MAX_OBJECTS ngày gần nhất (query theo partition pk=chat#YYYYMMDD)."""
+    today = datetime.now().date()
+    days = max(1, settings.RESPONSE_CACHE_WARMUP_MAX_OBJECTS)
+    for offset in range(days - 1, -1, -1):  # cũ -> mới
+        pk = f"chat#{(today - timedelta(days=offset)).strftime('%Y%m%d')}"
+        query_kwargs = {
+            'TableName': settings.AWS_DDB_TABLE,
+            'KeyConditionExpression': 'pk = :pk',
+            'ExpressionAttributeValues': {':pk': {'S': pk}},
+        }
+        while True:
+            resp = settings.ddb_client.query(**query_kwargs)
+            for it in resp.get('Items', []):
+                ev = {field: it.get(field, {}).get('S', '') for field in ('message', 'response', 'context', 'source')}
+                # Response có thể đã bị cắt: không cache câu trả lời không đầy đủ
+                if len(ev['response']) >= DDB_RESPONSE_LIMIT:
+                    continue
+                yield ev
+            if 'LastEvaluatedKey' not in resp:
+                break
+            query_kwargs['ExclusiveStartKey'] = resp['LastEvaluatedKey']
+
+
+def _aws_tally() -> Tuple[str, Tally]:
+    """
+    persist_chat_event ghi mỗi chat vào cả S3 và DynamoDB nên chỉ đọc một nguồn để không đếm trùng:
+    S3 (bản đầy đủ) nếu có, ngược lại DynamoDB, cùng cửa sổ RESPONSE_CACHE_WARMUP_MAX_OBJECTS ngày gần nhất.
+    """
+    if settings.s3_client and settings.AWS_S3_BUCKET:
+        # Chỉ đọc các file mới nhất (key YYYY/MM/DD), giữ thứ tự cũ -> mới
+        keys = [obj['Key'] for obj in list_log_objects()][-settings.RESPONSE_CACHE_WARMUP_MAX_OBJECTS:]
+        scanned = 0
+        counts: Counter = Counter()
+        latest: Dict[str, Optional[tuple]] = {}
+        for key, tally, error in fetch_objects(keys, _load_s3_tally):
+            if error is not None:
+                print(f"[WARN][Cache-warmup-S3] Error loading {key}: {error}")
+                continue
+            scanned += tally[0]
+            counts.update(tally[1])
+            latest.update(tally[2])
+        return 's3', (scanned, counts, latest)
+    return 'dynamodb', _tally(_iter_ddb_events())
+
+
+def warm_cache() -> dict:
+    """
+    Đếm tần suất (message, context) trong log, cache câu trả lời mới nhất của các cặp
+    được hỏi nhiều nhất (tối đa RESPONSE_CACHE_WARMUP_MAX_ITEMS).
+
+    Bỏ qua cặp có event sau cùng là feedback/correction và message mà KB hiện tại trả lời được
+    (/chat tra L1 trước KB nên câu trả lời model cũ sẽ che câu trả lời KB); các entry được gắn
+    version KB để lần publish sau có thể invalidate.
+    """
+    start = time.perf_counter()
+    warmup_status.update(state='running', source=settings.RESPONSE_CACHE_WARMUP, error=None)
+    if not kb.kb_ready.wait(KB_READY_TIMEOUT):
+        print(f"[WARN][Cache-warmup] KB not loaded after {KB_READY_TIMEOUT}s, warming against current snapshot")
+    scanned = 0
+    counts: Counter = Counter()
+    try:
+        if settings.RESPONSE_CACHE_WARMUP == 'aws':
+            aws_source, (scanned, counts, latest) = _aws_tally()
+            warmup_status['source'] = f"aws:{aws_source}"
+        else:
+            scanned, counts, latest = _tally(iter_local_events(settings.RESPONSE_CACHE_WARMUP))
+
+        budget = min(settings.RESPONSE_CACHE_WARMUP_MAX_ITEMS, cache.CACHE_MAX_SIZE)
+        snapshot = kb.get_snapshot()
+        top = []
+        kb_skips = feedback_skips = 0
+        for key, n in counts.most_common():
+            if len(top) >= budget or n < settings.RESPONSE_CACHE_WARMUP_MIN_COUNT:
+                break
+            if latest[key] is None:
+                feedback_skips += 1
+            elif kb.find_top_k_answers(latest[key][0], k=1, snapshot=snapshot, record=False):
+                kb_skips += 1
+            else:
+                top.append(key)
+        # Nạp từ ít -> nhiều để các câu hỏi phổ biến nhất nằm ở đầu MRU
+        for key in reversed(top):
+            message, context, response, source = latest[key]
+            cache.cache_response(message, context, response, source=source, kb_version=snapshot.version)
+
+        warmup_status.update(state='done', items_loaded=len(top), kb_skips=kb_skips, feedback_skips=feedback_skips)
+    except Exception as e:
+        print(f"[WARN][Cache-warmup] {e}")
+        warmup_status.update(state='failed', error=str(e))
+    warmup_status.update(
+        events_scanned=scanned,
+        candidates=len(counts),
+        duration_ms=round((time.perf_counter() - start) * 1000, 1),
+    )
+    print(f"[Cache] Warm-up {warmup_status['state']}: {warmup_status['items_loaded']} items "
+          f"from {scanned} events in {warmup_status['duration_ms']} ms")
+    return dict(warmup_status)
+
+
+def get_warmup_status() -> dict:
+    return dict(warmup_status)
+
+
+def start_warmup_thread():
+    """Chạy warm-up trong background thread nếu được cấu hình."""
+    if not settings.ENABLE_RESPONSE_CACHE or not settings.RESPONSE_CACHE_WARMUP:
+        return
+    if settings.RESPONSE_CACHE_WARMUP == 'aws' and not (settings.s3_client or settings.ddb_client):
+        print("[Cache] AWS not configured, skipping warm-up")
+        return
+    warmup_status['state'] = 'pending'
+    threading.Thread(target=warm_cache, daemon=True, name="CacheWarmup").start()
+
+
+start_warmup_thread()
@@ -1,15 +1,175 @@
 import json
+import math
+import os
+import random
+import tempfile
 import threading
 import time
+from collections import Counter, deque
+from itertools import chain
 from datetime import datetime, timedelta
 from difflib import SequenceMatcher
-from .utils import normalize_text, tokenize_keywords
+from .utils import normalize_text, tokenize_normalized
 
 from . import settings
+from .cache import invalidate_questions
+from .s3_logs import list_log_objects, fetch_objects, open_log_events
 
 
-qa_knowledge_base: list[dict] = []  # List[{"q": str, "a": str}]
-kb_lock = threading.Lock()
+def char_trigrams(norm: str) -> frozenset[str]:
+    """Tập trigram ký tự của chuỗi đã chuẩn hóa (có đệm khoảng trắng ở hai đầu)."""
+    if not norm:
+        return frozenset()
+    padded = f" {norm} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class KBItem:
+    """Một Q&A trong knowledge base, kèm các dạng chuẩn hóa được tính sẵn một lần khi thêm vào."""
+
+    __slots__ = ('q', 'a', 'norm_q', 'norm_a', 'tokens', 'length', 'trigrams')
+
+    def __init__(self, q: str, a: str):
+        self._set(q, a, normalize_text(q), normalize_text(a))
+
+    @classmethod
+    def restore(cls, q: str, a: str, norm_q: str, norm_a: str) -> "KBItem":
+        """Dựng lại item từ các dạng chuẩn hóa đã lưu (không gọi lại normalize_text)."""
+        item = cls.__new__(cls)
+        item._set(q, a, norm_q, norm_a)
+        return item
+
+    def _set(self, q: str, a: str, norm_q: str, norm_a: str) -> None:
+        self.q = q
+        self.a = a
+        self.norm_q = norm_q
+        self.norm_a = norm_a
+        words = tokenize_normalized(norm_q)
+        self.tokens = frozenset(words)
+        self.length = len(words)  # Độ dài document (số tokens, kể cả lặp) cho BM25
+        self.trigrams = char_trigrams(self.norm_q)
+
+    def __repr__(self) -> str:
+        return f"KBItem(q={self.q!r}, a={self.a[:30]!r})"
+
+
+class KBIndex:
+    """
+    Inverted index trên các câu hỏi trong KB.
+
+    postings: token -> posting list các item id (index trong KBSnapshot.items)
+    term_freqs: token -> tần suất token trong từng item, song song với postings
+    doc_lens / total_len: độ dài từng item và tổng độ dài (cho BM25)
+    trigram_postings: trigram ký tự -> posting list các item id
+    trigram_counts: số trigram của từng item (mẫu số của hệ số Dice)
+    """
+
+    __slots__ = ('postings', 'term_freqs', 'doc_lens', 'total_len', 'trigram_postings', 'trigram_counts')
+
+    def __init__(self):
+        self.postings: dict[str, list[int]] = {}
+        self.term_freqs: dict[str, list[int]] = {}
+        self.doc_lens: list[int] = []
+        self.total_len = 0
+        self.trigram_postings: dict[str, list[int]] = {}
+        self.trigram_counts: list[int] = []
+
+    @classmethod
+    def build(cls, items: list[KBItem]) -> "KBIndex":
+        index = cls()
+        for item_id, item in enumerate(items):
+            index.add(item_id, item)
+        return index
+
+    @classmethod
+    def restore(cls, items, postings: dict[str, list[int]], term_freqs: dict[str, list[int]]) -> "KBIndex":
+        """Dựng lại index từ token index đã lưu; phần trigram và độ dài được tính từ items."""
+        index = cls()
+        index.postings = postings
+        index.term_freqs = term_freqs
+        for item_id, item in enumerate(items):
+            index.doc_lens.append(item.length)
+            index.total_len += item.length
+            for gram in item.trigrams:
+                index.trigram_postings.setdefault(gram, []).append(item_id)
+            index.trigram_counts.append(len(item.trigrams))
+        return index
+
+    def add(self, item_id: int, item: KBItem) -> None:
+        for tok, freq in Counter(tokenize_normalized(item.norm_q)).items():
+            self.postings.setdefault(tok, []).append(item_id)
+            self.term_freqs.setdefault(tok, []).append(freq)
+        self.doc_lens.append(item.length)
+        self.total_len += item.length
+        for gram in item.trigrams:
+            self.trigram_postings.setdefault(gram, []).append(item_id)
+        self.trigram_counts.append(len(item.trigrams))
+
+    def candidates(self, tokens) -> set[int]:
+        """Các item id có chung ít nhất một token với câu hỏi."""
+        ids: set[int] = set()
+        for tok in tokens:
+            ids.update(self.postings.get(tok, ()))
+        return ids
+
+    def trigram_dice(self, trigrams: frozenset[str]) -> dict[int, float]:
+        """Hệ số Dice trên trigram ký tự (xấp xỉ nhanh của SequenceMatcher) cho các item có chung trigram."""
+        if not trigrams:
+            return {}
+        shared = Counter(chain.from_iterable(self.trigram_postings.get(g, ()) for g in trigrams))
+        n_query = len(trigrams)
+        counts = self.trigram_counts
+        return {item_id: 2.0 * n / (n_query + counts[item_id]) for item_id, n in shared.items()}
+
+    def bm25_scores(self, tokens, k1: float, b: float) -> tuple[dict[int, float], float]:
+        """
+        Chấm điểm BM25 cho mọi item trong một lượt duyệt posting lists của các token truy vấn.
+
+        Returns:
+            (scores, max_score): scores theo item id và tổng idf của truy vấn
+            (điểm của một item khớp đủ mọi token với độ dài trung bình), dùng để chuẩn hóa về [0, 1]
+        """
+        n_docs = len(self.doc_lens)
+        scores: dict[int, float] = {}
+        if not n_docs:
+            return scores, 0.0
+        avgdl = self.total_len / n_docs or 1.0
+        doc_lens = self.doc_lens
+        max_score = 0.0
+        for tok in tokens:
+            ids = self.postings.get(tok, ())
+            df = len(ids)
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            max_score += idf
+            if not df:
+                continue
+            for item_id, freq in zip(ids, self.term_freqs[tok]):
+                norm = k1 * (1.0 - b + b * doc_lens[item_id] / avgdl)
+                scores[item_id] = scores.get(item_id, 0.0) + idf * freq * (k1 + 1.0) / (freq + norm)
+        return scores, max_score
+
+
+class KBSnapshot:
+    """
+    Ảnh chụp bất biến của knowledge base: danh sách items cùng index của chúng.
+
+    Readers lấy tham chiếu qua get_snapshot() mà không cần lock; writers (reload, feedback,
+    auto-learning) dựng snapshot mới rồi thay thế nguyên tử, không bao giờ sửa snapshot đã publish.
+    """
+
+    __slots__ = ('items', 'index', 'version', 'created_at')
+
+    def __init__(self, items: tuple[KBItem, ...], index: KBIndex, version: int):
+        self.items = items
+        self.index = index
+        self.version = version
+        self.created_at = datetime.now()
+
+
+_snapshot: KBSnapshot = KBSnapshot((), KBIndex(), 0)
+kb_lock = threading.Lock()  # Chỉ dùng để tuần tự hóa writers, readers không lock
+# Được set sau lần load KB đầu tiên lúc khởi động (thành công hay không), vd. để warm-up cache đợi KB
+kb_ready = threading.Event()
 kb_last_reload_time: datetime = None  # Track lần cuối reload
 kb_reload_count: int = 0  # Đếm số lần reload
 auto_reload_thread: threading.Thread = None  # Background thread cho auto-reload
@@ -17,14 +177,57 @@ auto_reload_thread: threading.Thread = None  # Background thread cho auto-reload
 # Metrics
 kb_queries: int = 0
 kb_hits: int = 0
+# Latency (ms) các lượt tìm kiếm gần nhất theo từng đường đi:
+# 'trigram' = lọc trigram + SequenceMatcher trên top ứng viên, 'full_scan' = SequenceMatcher trên mọi ứng viên
+kb_lookup_latency: dict[str, deque] = {}
+
+# Manifest các file S3 đã load: key -> {'etag', 'size', 'last_modified', 'items'}
+kb_s3_manifest: dict[str, dict] = {}
+kb_last_fetch_stats: dict = {}  # objects/bytes đã tải ở lần reload gần nhất
+
+# Snapshot KB trên đĩa local để warm start
+LOCAL_SNAPSHOT_FORMAT = 2  # 2: JSON (1: pickle, không còn đọc)
+kb_local_snapshot_info: dict = {'loaded_at': None, 'load_ms': None, 'saved_at': None}
+
+
+def is_feedback_source(source: str) -> bool:
+    """Event là feedback của người dùng (confirm/correct) hoặc câu trả lời đã được tự động sửa."""
+    source = (source or '').strip().lower()
+    return 'feedback' in source or 'corrected' in source or 'confirm' in source
+
+
+def _make_raw_item(msg: str, ans: str, source: str):
+    """Chuyển một event (message/response/source) thành raw item có priority, None nếu không hợp lệ."""
+    msg = (msg or '').strip()
+    ans = (ans or '').strip()
+    if msg and ans and len(msg) > 3 and len(ans) > 2:
+        # Ưu tiên các response từ feedback hoặc auto-corrected
+        if is_feedback_source(source):
+            return {'q': msg, 'a': ans, 'priority': 2}
+        return {'q': msg, 'a': ans, 'priority': 1}
+    return None
+
+
+def _load_s3_object_items(key: str) -> tuple[list[dict], int]:
+    """Đọc stream và parse một file chat log trên S3. Trả về (raw items, số bytes đã tải)."""
+    events, nbytes = open_log_events(key)
+    items = []
+    for ev in events:
+        item = _make_raw_item(ev.get('message', ''), ev.get('response', ''), ev.get('source', ''))
+        if item:
+            items.append(item)
+    return items, nbytes
 
 
 def load_qa_knowledge_base(force_reload: bool = False) -> dict:
     """
     Load knowledge base từ AWS (DynamoDB và S3).
+
+    S3 được load tăng dần: manifest giữ (ETag, size, LastModified) và items đã parse của
+    từng file, lần reload sau chỉ tải lại các file mới hoặc đã thay đổi.
     
     Args:
-        force_reload: Nếu True, reload ngay cả khi không có thay đổi
+        force_reload: Nếu True, tải lại mọi file S3 (bỏ qua manifest)
         
     Returns:
         dict với thông tin về quá trình reload: {
@@ -32,16 +235,23 @@ def load_qa_knowledge_base(force_reload: bool = False) -> dict:
             'items_count': int,
             'previous_count': int,
             'timestamp': str,
+            'fetch': dict (objects/bytes đã tải từ S3),
             'error': str (nếu có)
         }
     """
-    global qa_knowledge_base, kb_last_reload_time, kb_reload_count
+    global kb_last_reload_time, kb_reload_count, kb_s3_manifest, kb_last_fetch_stats
     items: list[dict] = []
     previous_count = 0
+    fetch_stats = {
+        'objects_listed': 0,
+        'objects_fetched': 0,
+        'objects_reused': 0,
+        'bytes_fetched': 0,
+    }
+    new_manifest = None
     
     try:
-        with kb_lock:
-            previous_count = len(qa_knowledge_base)
+        previous_count = len(_snapshot.items)
         
         # Prefer DynamoDB - tăng limit để lấy nhiều hơn
         if settings.ddb_client and settings.AWS_DDB_TABLE:
@@ -51,16 +261,13 @@ def load_qa_knowledge_base(force_reload: bool = False) -> dict:
                 while True:
                     resp = settings.ddb_client.scan(**scan_kwargs)
                     for it in resp.get('Items', []):
-                        msg = it.get('message', {}).get('S', '').strip()
-                        ans = it.get('response', {}).get('S', '').strip()
-                        # Chỉ lấy các items có source là user-feedback hoặc confirmed
-                        source = it.get('source', {}).get('S', '').strip().lower()
-                        if msg and ans and len(msg) > 3 and len(ans) > 2:
-                            # Ưu tiên các response từ feedback hoặc auto-corrected
-                            if 'feedback' in source or 'corrected' in source or 'confirm' in source:
-                                items.append({'q': msg, 'a': ans, 'priority': 2})
-                            else:
-                                items.append({'q': msg, 'a': ans, 'priority': 1})
+                        item = _make_raw_item(
+                            it.get('message', {}).get('S', ''),
+                            it.get('response', {}).get('S', ''),
+                            it.get('source', {}).get('S', ''),
+                        )
+                        if item:
+                            items.append(item)
                     
                     # Pagination
                     if 'LastEvaluatedKey' not in resp:
@@ -72,74 +279,69 @@ def load_qa_knowledge_base(force_reload: bool = False) -> dict:
         # Add from S3 - load toàn bộ database để tự học từ tất cả lịch sử
         if settings.s3_client and settings.AWS_S3_BUCKET:
             try:
-                # List tất cả các files trong S3 với prefix LEARNING_S3_PREFIX
-                prefix = f"{settings.LEARNING_S3_PREFIX}/"
-                paginator = settings.s3_client.get_paginator('list_objects_v2')
-                pages = paginator.paginate(Bucket=settings.AWS_S3_BUCKET, Prefix=prefix)
-                
-                all_keys = []
-                for page in pages:
-                    if 'Contents' in page:
-                        for obj in page['Contents']:
-                            key = obj['Key']
-                            # Chỉ lấy các file .ndjson
-                            if key.endswith('.ndjson'):
-                                all_keys.append(key)
+                # List tất cả các files chat log (.ndjson / .ndjson.gz) trong S3 với prefix LEARNING_S3_PREFIX
+                listed = list_log_objects()
+                fetch_stats['objects_listed'] = len(listed)
                 
-                print(f"[KB] Found {len(all_keys)} files in S3, loading all data...")
+                old_manifest = {} if force_reload else kb_s3_manifest
+                new_manifest = {}
+                to_fetch = {}  # key -> (etag, size, last_modified)
+                for obj in listed:
+                    key = obj['Key']
+                    etag = obj.get('ETag', '')
+                    size = obj.get('Size', 0)
+                    last_modified = obj.get('LastModified')
+                    last_modified = last_modified.isoformat() if hasattr(last_modified, 'isoformat') else str(last_modified or '')
+                    entry = old_manifest.get(key)
+                    if entry and entry['etag'] == etag and entry['size'] == size:
+                        # File không đổi -> dùng lại items đã parse
+                        new_manifest[key] = entry
+                        fetch_stats['objects_reused'] += 1
+                    else:
+                        to_fetch[key] = (etag, size, last_modified)
                 
-                # Load tất cả các files
-                for key in all_keys:
-                    try:
-                        obj = settings.s3_client.get_object(Bucket=settings.AWS_S3_BUCKET, Key=key)
-                        body = obj['Body'].read().decode('utf-8')
-                        lines = [ln for ln in body.strip().split('\n') if ln.strip()]
-                        # Load tất cả dòng từ mỗi file (không giới hạn)
-                        for ln in lines:
-                            try:
-                                ev = json.loads(ln)
-                            except Exception:
-                                continue
-                            msg = ev.get('message', '').strip()
-                            ans = ev.get('response', '').strip()
-                            source = ev.get('source', '').strip().lower()
-                            if msg and ans and len(msg) > 3 and len(ans) > 2:
-                                # Ưu tiên các response từ feedback
-                                if 'feedback' in source or 'corrected' in source or 'confirm' in source:
-                                    items.append({'q': msg, 'a': ans, 'priority': 2})
-                                else:
-                                    items.append({'q': msg, 'a': ans, 'priority': 1})
-                    except Exception as e:
-                        # Tiếp tục với file tiếp theo nếu có lỗi
-                        print(f"[WARN][KB-load-S3] Error loading {key}: {e}")
+                # Tải song song các file mới/đã thay đổi (kết quả giữ đúng thứ tự key)
+                for key, result, error in fetch_objects(list(to_fetch), _load_s3_object_items):
+                    if error is not None:
+                        # Tiếp tục với file tiếp theo nếu có lỗi, giữ bản cũ (nếu có) để không mất dữ liệu
+                        print(f"[WARN][KB-load-S3] Error loading {key}: {error}")
+                        if key in old_manifest:
+                            new_manifest[key] = old_manifest[key]
                         continue
+                    file_items, nbytes = result
+                    etag, size, last_modified = to_fetch[key]
+                    fetch_stats['objects_fetched'] += 1
+                    fetch_stats['bytes_fetched'] += nbytes
+                    new_manifest[key] = {
+                        'etag': etag,
+                        'size': size,
+                        'last_modified': last_modified,
+                        'items': file_items,
+                    }
+                
+                print(f"[KB] Found {len(listed)} files in S3: fetched {fetch_stats['objects_fetched']} "
+                      f"({fetch_stats['bytes_fetched']} bytes), reused {fetch_stats['objects_reused']}")
+                
+                # Giữ thứ tự key (YYYY/MM/DD) để bước dedup vẫn ưu tiên items mới hơn
+                for key in sorted(new_manifest):
+                    items.extend(new_manifest[key]['items'])
                         
             except Exception as e:
                 print(f"[WARN][KB-load-S3] Error listing S3 objects: {e}")
+                new_manifest = None
                 # Fallback: thử load 30 ngày gần nhất nếu không list được
                 days_to_check = 30
-                for offset in range(0, days_to_check):
+                keys = []
+                for offset in reversed(range(0, days_to_check)):
                     date = datetime.now() - timedelta(days=offset)
-                    key = f"{settings.LEARNING_S3_PREFIX}/{date.strftime('%Y/%m/%d')}.ndjson"
-                    try:
-                        obj = settings.s3_client.get_object(Bucket=settings.AWS_S3_BUCKET, Key=key)
-                        body = obj['Body'].read().decode('utf-8')
-                        lines = [ln for ln in body.strip().split('\n') if ln.strip()]
-                        for ln in lines:
-                            try:
-                                ev = json.loads(ln)
-                            except Exception:
-                                continue
-                            msg = ev.get('message', '').strip()
-                            ans = ev.get('response', '').strip()
-                            source = ev.get('source', '').strip().lower()
-                            if msg and ans and len(msg) > 3 and len(ans) > 2:
-                                if 'feedback' in source or 'corrected' in source or 'confirm' in source:
-                                    items.append({'q': msg, 'a': ans, 'priority': 2})
-                                else:
-                                    items.append({'q': msg, 'a': ans, 'priority': 1})
-                    except Exception:
+                    keys.append(f"{settings.LEARNING_S3_PREFIX}/{date.strftime('%Y/%m/%d')}.ndjson")
+                for key, result, error in fetch_objects(keys, _load_s3_object_items):
+                    if error is not None:
                         continue
+                    file_items, nbytes = result
+                    fetch_stats['objects_fetched'] += 1
+                    fetch_stats['bytes_fetched'] += nbytes
+                    items.extend(file_items)
         
         # Deduplicate (ưu tiên items có priority cao hơn và mới hơn)
         dedup: dict[str, dict] = {}
@@ -150,21 +352,29 @@ def load_qa_knowledge_base(force_reload: bool = False) -> dict:
                 if k not in dedup or dedup[k].get('priority', 1) < it.get('priority', 1):
                     dedup[k] = it
         
-        final_items = [{'q': it['q'], 'a': it['a']} for it in dedup.values()]
+        # Dùng lại KBItem (đã chuẩn hóa sẵn) của snapshot hiện tại cho các Q&A không đổi
+        existing = {(it.q, it.a): it for it in _snapshot.items}
+        final_items = tuple(existing.get((it['q'], it['a'])) or KBItem(it['q'], it['a']) for it in dedup.values())
+        index = KBIndex.build(final_items)
         
         with kb_lock:
-            old_count = len(qa_knowledge_base)
-            qa_knowledge_base = final_items
+            old_count = len(_snapshot.items)
+            snapshot = _publish(final_items, index)
+            if new_manifest is not None:
+                kb_s3_manifest = new_manifest
+            kb_last_fetch_stats = fetch_stats
             kb_last_reload_time = datetime.now()
             kb_reload_count += 1
         
-        print(f"[KB] Reloaded: {old_count} -> {len(final_items)} QA items from AWS (reload #{kb_reload_count})")
+        print(f"[KB] Reloaded: {old_count} -> {len(final_items)} QA items from AWS (reload #{kb_reload_count}, version {snapshot.version})")
+        save_local_snapshot(snapshot)
         
         return {
             'success': True,
             'items_count': len(final_items),
             'previous_count': previous_count,
             'timestamp': kb_last_reload_time.strftime("%Y-%m-%d %H:%M:%S"),
+            'fetch': fetch_stats,
             'error': None
         }
         
@@ -176,10 +386,115 @@ def load_qa_knowledge_base(force_reload: bool = False) -> dict:
             'items_count': previous_count,
             'previous_count': previous_count,
             'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'fetch': fetch_stats,
             'error': error_msg
         }
 
 
+def save_local_snapshot(snapshot: KBSnapshot = None) -> bool:
+    """
+    Ghi snapshot KB (items, dạng chuẩn hóa, token index và S3 manifest) ra KB_SNAPSHOT_PATH dạng JSON.
+    Mỗi lần ghi dùng một file tạm riêng (mkstemp cùng thư mục) rồi os.replace, nên nhiều worker
+    cùng ghi cũng không tạo ra file hỏng.
+    """
+    path = settings.KB_SNAPSHOT_PATH
+    if not path:
+        return False
+    snap = snapshot if snapshot is not None else _snapshot
+    payload = {
+        'format': LOCAL_SNAPSHOT_FORMAT,
+        'created_at': snap.created_at.isoformat(),
+        'items': [(it.q, it.a, it.norm_q, it.norm_a) for it in snap.items],
+        'postings': snap.index.postings,
+        'term_freqs': snap.index.term_freqs,
+        'manifest': kb_s3_manifest,
+    }
+    tmp_path = None
+    try:
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        tmp_path = None
+        kb_local_snapshot_info['saved_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return True
+    except Exception as e:
+        print(f"[WARN][KB-snapshot] Failed to save {path}: {e}")
+        return False
+    finally:
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+def _check_snapshot_payload(payload) -> None:
+    """
+    Kiểm tra cấu trúc snapshot đọc từ đĩa (file nằm trên volume có thể bị ghi từ bên ngoài):
+    sai kiểu hoặc item id ngoài phạm vi thì raise ValueError thay vì publish index hỏng.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("payload is not an object")
+    rows = payload.get('items')
+    if not isinstance(rows, list) or not all(
+        isinstance(row, list) and len(row) == 4 and all(isinstance(v, str) for v in row) for row in rows
+    ):
+        raise ValueError("invalid items")
+    postings = payload.get('postings')
+    term_freqs = payload.get('term_freqs')
+    if not isinstance(postings, dict) or not isinstance(term_freqs, dict) or postings.keys() != term_freqs.keys():
+        raise ValueError("invalid token index")
+    n_items = len(rows)
+    for tok, ids in postings.items():
+        freqs = term_freqs[tok]
+        if (not isinstance(ids, list) or not isinstance(freqs, list) or len(ids) != len(freqs)
+                or not all(type(i) is int and 0 <= i < n_items for i in ids)
+                or not all(type(n) is int for n in freqs)):
+            raise ValueError(f"invalid posting list for {tok!r}")
+    if not isinstance(payload.get('manifest') or {}, dict):
+        raise ValueError("invalid manifest")
+
+
+def load_local_snapshot() -> bool:
+    """
+    Nạp snapshot KB từ KB_SNAPSHOT_PATH (nếu có) và publish ngay, dùng khi khởi động
+    trước khi reload đầy đủ từ AWS. Manifest được khôi phục để lần reload sau chỉ tải phần thay đổi.
+    """
+    global kb_s3_manifest
+    path = settings.KB_SNAPSHOT_PATH
+    if not path or not os.path.exists(path):
+        return False
+    started = time.perf_counter()
+    try:
+        # JSON: đọc file không bao giờ thực thi code (khác pickle)
+        with open(path, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+        if not isinstance(payload, dict) or payload.get('format') != LOCAL_SNAPSHOT_FORMAT:
+            print(f"[KB-snapshot] Ignoring {path}: unsupported format")
+            return False
+        _check_snapshot_payload(payload)
+        items = tuple(KBItem.restore(*row) for row in payload['items'])
+        index = KBIndex.restore(items, payload['postings'], payload['term_freqs'])
+    except Exception as e:
+        print(f"[WARN][KB-snapshot] Failed to load {path}: {e}")
+        return False
+
+    with kb_lock:
+        # Không ghi đè nếu reload từ AWS đã kịp publish trước
+        if _snapshot.items:
+            return False
+        snapshot = _publish(items, index)
+        kb_s3_manifest = payload.get('manifest') or {}
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    kb_local_snapshot_info['loaded_at'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    kb_local_snapshot_info['load_ms'] = round(elapsed_ms, 1)
+    print(f"[KB] Loaded local snapshot: {len(items)} QA items in {elapsed_ms:.1f} ms (version {snapshot.version}, saved {payload.get('created_at')})")
+    return True
+
+
 def _jaccard(a: set[str], b: set[str]) -> float:
     if not a or not b:
         return 0.0
@@ -188,38 +503,319 @@ def _jaccard(a: set[str], b: set[str]) -> float:
     return inter / max(union, 1)
 
 
-def find_best_local_answer(q: str, threshold: float = None):
-    # Configurable thresholds
+def get_snapshot() -> KBSnapshot:
+    """Snapshot KB hiện tại (đọc tham chiếu là nguyên tử, không cần lock)."""
+    return _snapshot
+
+
+def _changed_questions(old_items, new_items) -> set[str]:
+    """Các câu hỏi được thêm, xóa hoặc đổi câu trả lời giữa hai snapshot."""
+    old_answers = {_question_key(it.q): it.a for it in old_items}
+    changed = set()
+    for it in new_items:
+        key = _question_key(it.q)
+        if old_answers.pop(key, None) != it.a:
+            changed.add(key)
+    changed.update(old_answers)  # Còn lại là các câu hỏi đã bị xóa
+    return changed
+
+
+def _publish(items: tuple[KBItem, ...], index: KBIndex = None) -> KBSnapshot:
+    """
+    Dựng snapshot mới từ items và thay thế snapshot hiện tại. Caller phải giữ kb_lock.
+    Các câu hỏi thay đổi được invalidate trong response cache.
+    """
+    global _snapshot
+    if index is None:
+        index = KBIndex.build(items)
+    previous = _snapshot
+    snapshot = KBSnapshot(items, index, previous.version + 1)
+    _snapshot = snapshot
+    # Luôn báo version mới cho cache (kể cả khi không có câu hỏi đổi) để câu trả lời
+    # tính trên snapshot cũ không được cache sau thời điểm này. KB trước đó rỗng thì mọi câu hỏi
+    # đều "thay đổi": chỉ xóa entry trùng câu hỏi, không quét entry gần giống
+    invalidate_questions(
+        _changed_questions(previous.items, items),
+        kb_version=snapshot.version,
+        near_duplicates=bool(previous.items),
+    )
+    return snapshot
+
+
+def _question_key(q: str) -> str:
+    return q.strip().lower()
+
+
+def upsert_items(pairs: list[tuple[str, str]], overwrite: bool = True) -> int:
+    """
+    Thêm hoặc cập nhật nhiều Q&A và publish một snapshot mới (một lần rebuild index cho cả lô).
+
+    Args:
+        pairs: List[(question, answer)]
+        overwrite: Nếu False, bỏ qua các câu hỏi đã có trong KB
+
+    Returns:
+        Số items thêm mới
+    """
+    new_items = [KBItem(q, a) for q, a in pairs]
+    if not new_items:
+        return 0
+    with kb_lock:
+        items = list(_snapshot.items)
+        positions = {_question_key(it.q): idx for idx, it in enumerate(items)}
+        added = 0
+        for item in new_items:
+            key = _question_key(item.q)
+            idx = positions.get(key)
+            if idx is None:
+                positions[key] = len(items)
+                items.append(item)
+                added += 1
+            elif overwrite:
+                items[idx] = item
+        # Chỉ thay câu trả lời (cùng câu hỏi -> cùng tokens) thì dùng lại index cũ
+        _publish(tuple(items), None if added else _snapshot.index)
+    return added
+
+
+def upsert_item(question: str, answer: str) -> bool:
+    """
+    Thêm hoặc cập nhật một Q&A trong knowledge base.
+
+    Returns:
+        True nếu thêm mới, False nếu đã có câu hỏi (chỉ thay câu trả lời)
+    """
+    return upsert_items([(question, answer)]) > 0
+
+
+def remove_item(question: str) -> int:
+    """Xóa Q&A theo câu hỏi và publish snapshot mới. Trả về số items đã xóa."""
+    key = _question_key(question)
+    with kb_lock:
+        kept = tuple(it for it in _snapshot.items if _question_key(it.q) != key)
+        removed = len(_snapshot.items) - len(kept)
+        if removed:
+            _publish(kept)
+    return removed
+
+
+def _score_classic(
+    snap: KBSnapshot,
+    norm_q: str,
+    q_tokens: set[str],
+    threshold: float = None,
+    jaccard_threshold: float = None,
+) -> list[dict]:
+    """
+    Max(SequenceMatcher, Jaccard) trên mọi item (kết quả giống hệt lượt quét đầy đủ ban đầu).
+
+    Item không có chung token với câu hỏi có Jaccard = 0 nên chỉ có thể đạt qua SequenceMatcher:
+    với các item này, cận trên real_quick_ratio()/quick_ratio() được kiểm tra trước để bỏ qua ratio().
+    """
     similarity_threshold = threshold if threshold is not None else settings.KB_SIMILARITY_THRESHOLD
-    jaccard_threshold = settings.KB_JACCARD_THRESHOLD
+    if jaccard_threshold is None:
+        jaccard_threshold = settings.KB_JACCARD_THRESHOLD
+
+    token_candidates = snap.index.candidates(q_tokens)
+    matcher = SequenceMatcher(None, norm_q)
+    matches = []
+    for item_id, item in enumerate(snap.items):
+        matcher.set_seq2(item.norm_q)
+        if item_id not in token_candidates and jaccard_threshold > 0:
+            if matcher.real_quick_ratio() < similarity_threshold or matcher.quick_ratio() < similarity_threshold:
+                continue
+        # Two signals (dạng chuẩn hóa và tokens đã được tính sẵn trong KBItem)
+        seq_score = matcher.ratio()
+        jacc = _jaccard(q_tokens, item.tokens)
+        # Accept if either signal clears its threshold
+        if (seq_score >= similarity_threshold) or (jacc >= jaccard_threshold):
+            matches.append({
+                'q': item.q,
+                'a': item.a,
+                'score': max(seq_score, jacc),
+                'seq': seq_score,
+                'jaccard': jacc,
+            })
+    return matches
+
+
+def _score_trigram(
+    snap: KBSnapshot,
+    norm_q: str,
+    q_tokens: set[str],
+    threshold: float = None,
+    jaccard_threshold: float = None,
+) -> list[dict]:
+    """
+    Như _score_classic nhưng chỉ chạy SequenceMatcher trên KB_SEQ_CANDIDATES items có
+    hệ số Dice trigram cao nhất; các items còn lại chỉ được chấp nhận qua Jaccard.
+    """
+    similarity_threshold = threshold if threshold is not None else settings.KB_SIMILARITY_THRESHOLD
+    if jaccard_threshold is None:
+        jaccard_threshold = settings.KB_JACCARD_THRESHOLD
+
+    items = snap.items
+    dice = snap.index.trigram_dice(char_trigrams(norm_q))
+    top_ids = sorted(dice, key=lambda i: (-dice[i], i))[:settings.KB_SEQ_CANDIDATES]
+    seq_scores = {i: SequenceMatcher(None, norm_q, items[i].norm_q).ratio() for i in top_ids}
+
+    matches = []
+    for item_id in sorted(snap.index.candidates(q_tokens) | seq_scores.keys()):
+        item = items[item_id]
+        seq_score = seq_scores.get(item_id)
+        jacc = _jaccard(q_tokens, item.tokens)
+        if (seq_score is not None and seq_score >= similarity_threshold) or (jacc >= jaccard_threshold):
+            matches.append({
+                'q': item.q,
+                'a': item.a,
+                'score': max(seq_score or 0.0, jacc),
+                'seq': seq_score,
+                'dice': dice.get(item_id, 0.0),
+                'jaccard': jacc,
+            })
+    return matches
+
+
+def _record_latency(path: str, elapsed_ms: float) -> None:
+    samples = kb_lookup_latency.get(path)
+    if samples is None:
+        samples = kb_lookup_latency.setdefault(path, deque(maxlen=settings.KB_LATENCY_SAMPLES))
+    samples.append(elapsed_ms)
+
 
+def _latency_summary() -> dict:
+    summary = {}
+    for path, samples in list(kb_lookup_latency.items()):
+        values = sorted(samples)
+        if not values:
+            continue
+        summary[path] = {
+            'p50_ms': round(values[int(0.50 * (len(values) - 1))], 3),
+            'p99_ms': round(values[int(0.99 * (len(values) - 1))], 3),
+            'samples': len(values),
+        }
+    return summary
+
+
+def _score_bm25(snap: KBSnapshot, q_tokens: set[str], threshold: float = None) -> list[dict]:
+    """BM25 chuẩn hóa về [0, 1] trên toàn bộ KB."""
+    bm25_threshold = threshold if threshold is not None else settings.KB_BM25_THRESHOLD
+    scores, max_score = snap.index.bm25_scores(q_tokens, settings.KB_BM25_K1, settings.KB_BM25_B)
+    if max_score <= 0:
+        return []
+
+    matches = []
+    for item_id in sorted(scores):
+        score = min(1.0, scores[item_id] / max_score)
+        if score >= bm25_threshold:
+            item = snap.items[item_id]
+            matches.append({
+                'q': item.q,
+                'a': item.a,
+                'score': score,
+                'bm25': scores[item_id],
+                'jaccard': _jaccard(q_tokens, item.tokens),
+            })
+    return matches
+
+
+def find_top_k_answers(
+    q: str,
+    k: int = None,
+    threshold: float = None,
+    snapshot: KBSnapshot = None,
+    jaccard_threshold: float = None,
+    record: bool = True,
+) -> list[dict]:
+    """
+    Tìm top-k câu trả lời trong knowledge base cho câu hỏi.
+
+    Engine chọn theo settings.KB_RETRIEVAL_MODE:
+        - 'classic': max(SequenceMatcher, Jaccard), mỗi tín hiệu có ngưỡng riêng
+        - 'bm25': BM25 trên tokens, chuẩn hóa về [0, 1] và so với KB_BM25_THRESHOLD
+
+    Args:
+        q: Câu hỏi
+        k: Số kết quả tối đa (mặc định settings.KB_TOP_K)
+        threshold: Ghi đè ngưỡng chính của engine (SequenceMatcher hoặc BM25)
+        snapshot: Snapshot để tìm (mặc định snapshot hiện tại)
+        jaccard_threshold: Ghi đè ngưỡng Jaccard (mode classic)
+        record: Ghi latency vào metrics của /chat (tắt cho các lô tra cứu offline như /kb/search)
+
+    Returns:
+        List[{'q', 'a', 'score', ...}] sắp xếp theo score giảm dần
+    """
+    k = k if k is not None else settings.KB_TOP_K
+    norm_q = normalize_text(q)
+    q_tokens = set(tokenize_normalized(norm_q))
+
+    snap = snapshot if snapshot is not None else _snapshot
+    started = time.perf_counter()
+    if settings.KB_RETRIEVAL_MODE == 'bm25':
+        matches = _score_bm25(snap, q_tokens, threshold)
+        path = 'bm25'
+    elif settings.KB_SEQ_CANDIDATES > 0:
+        matches = _score_trigram(snap, norm_q, q_tokens, threshold, jaccard_threshold)
+        path = 'trigram'
+    else:
+        matches = _score_classic(snap, norm_q, q_tokens, threshold, jaccard_threshold)
+        path = 'full_scan'
+    if record:
+        _record_latency(path, (time.perf_counter() - started) * 1000)
+        # Chẩn đoán (mặc định tắt): đo thêm đường cũ (SequenceMatcher trên mọi ứng viên) để so sánh latency
+        if path == 'trigram' and random.random() < settings.KB_LATENCY_BASELINE_SAMPLE_RATE:
+            started = time.perf_counter()
+            _score_classic(snap, norm_q, q_tokens, threshold, jaccard_threshold)
+            _record_latency('full_scan', (time.perf_counter() - started) * 1000)
+
+    # sort ổn định: cùng score thì item đứng trước trong KB được ưu tiên
+    matches.sort(key=lambda m: m['score'], reverse=True)
+    return matches[:max(k, 0)]
+
+
+def find_best_local_match(q: str, threshold: float = None) -> dict | None:
+    """Match tốt nhất ({'q', 'a', 'score', ..., 'version'}) hoặc None; 'version' là version snapshot đã tìm."""
     global kb_queries, kb_hits
     kb_queries += 1
 
-    norm_q = normalize_text(q)
-    q_tokens = set(tokenize_keywords(q))
-    best_score = 0.0
-    best_ans = None
+    snap = _snapshot
+    matches = find_top_k_answers(q, k=1, threshold=threshold, snapshot=snap)
+    if not matches:
+        return None
+    kb_hits += 1
+    return dict(matches[0], version=snap.version)
+
+
+def find_best_local_answer(q: str, threshold: float = None):
+    match = find_best_local_match(q, threshold)
+    return match['a'] if match else None
 
-    with kb_lock:
-        for item in qa_knowledge_base:
-            qkb_raw = item['q']
-            a_raw = item['a']
-            norm_kb_q = normalize_text(qkb_raw)
-            kb_tokens = set(tokenize_keywords(qkb_raw))
-            # Two signals
-            seq_score = SequenceMatcher(None, norm_q, norm_kb_q).ratio()
-            jacc = _jaccard(q_tokens, kb_tokens)
-            combined = max(seq_score, jacc)
-            # Accept if either signal clears its threshold
-            if (seq_score >= similarity_threshold) or (jacc >= jaccard_threshold):
-                if combined > best_score:
-                    best_score = combined
-                    best_ans = a_raw
-
-    if best_ans is not None:
-        kb_hits += 1
-    return best_ans
+
+def search_batch(
+    queries: list[str],
+    k: int = None,
+    threshold: float = None,
+    jaccard_threshold: float = None,
+) -> dict:
+    """
+    Tìm top-k cho nhiều câu hỏi trên cùng một snapshot (kết quả nhất quán trong cả lô).
+    Mỗi câu hỏi (khác nhau sau khi chuẩn hóa) được chấm điểm một lần bằng find_top_k_answers,
+    không ghi latency để các lô offline không làm lệch p50/p99 của /chat.
+
+    Returns:
+        dict: {'version': int, 'results': List[List[match]]} theo đúng thứ tự queries
+    """
+    snap = _snapshot
+    computed: dict[str, list[dict]] = {}
+    results = []
+    for q in queries:
+        norm_q = normalize_text(q)
+        if norm_q not in computed:
+            computed[norm_q] = find_top_k_answers(
+                q, k=k, threshold=threshold, snapshot=snap, jaccard_threshold=jaccard_threshold, record=False
+            )
+        results.append(computed[norm_q])
+    return {'version': snap.version, 'results': results}
 
 
 def start_auto_reload_background_thread():
@@ -262,32 +858,51 @@ def start_auto_reload_background_thread():
 
 def get_kb_status() -> dict:
     """Lấy thông tin trạng thái của knowledge base."""
-    with kb_lock:
-        return {
-            'items_count': len(qa_knowledge_base),
-            'last_reload_time': kb_last_reload_time.strftime("%Y-%m-%d %H:%M:%S") if kb_last_reload_time else None,
-            'reload_count': kb_reload_count,
-            'auto_reload_enabled': settings.LEARNING_AUTO_RELOAD_ENABLED,
-            'auto_reload_interval': settings.LEARNING_AUTO_RELOAD_INTERVAL,
-            'aws_configured': bool(settings.boto3 and (settings.s3_client or settings.ddb_client)),
-            'metrics': {
-                'kb_queries': kb_queries,
-                'kb_hits': kb_hits,
-                'kb_hit_rate': (kb_hits / kb_queries) if kb_queries else 0.0
-            }
+    snap = _snapshot
+    return {
+        'items_count': len(snap.items),
+        'version': snap.version,
+        'last_reload_time': kb_last_reload_time.strftime("%Y-%m-%d %H:%M:%S") if kb_last_reload_time else None,
+        'reload_count': kb_reload_count,
+        'auto_reload_enabled': settings.LEARNING_AUTO_RELOAD_ENABLED,
+        'auto_reload_interval': settings.LEARNING_AUTO_RELOAD_INTERVAL,
+        'aws_configured': bool(settings.boto3 and (settings.s3_client or settings.ddb_client)),
+        's3_manifest_objects': len(kb_s3_manifest),
+        'last_reload_fetch': kb_last_fetch_stats,
+        'local_snapshot': dict(kb_local_snapshot_info, path=settings.KB_SNAPSHOT_PATH or None),
+        'metrics': {
+            'kb_queries': kb_queries,
+            'kb_hits': kb_hits,
+            'kb_hit_rate': (kb_hits / kb_queries) if kb_queries else 0.0,
+            'seq_candidates': settings.KB_SEQ_CANDIDATES,
+            'lookup_latency': _latency_summary(),
         }
+    }
+
 
+def trigger_reload(force: bool = False) -> dict:
+    """
+    Trigger reload knowledge base ngay lập tức.
+
+    Args:
+        force: Nếu True, tải lại toàn bộ file S3 thay vì chỉ các file mới/đã thay đổi
+    """
+    print(f"[KB] Manual reload triggered (force={force})")
+    return load_qa_knowledge_base(force_reload=force)
 
-def trigger_reload() -> dict:
-    """Trigger reload knowledge base ngay lập tức."""
-    print("[KB] Manual reload triggered")
-    return load_qa_knowledge_base(force_reload=True)
 
+# Warm start: nạp snapshot local đồng bộ để KB có dữ liệu ngay khi server nhận request
+load_local_snapshot()
 
 # Background load at startup if AWS configured
 if settings.boto3 and (settings.s3_client or settings.ddb_client):
-    # Load ngay lập tức khi startup
-    threading.Thread(target=lambda: load_qa_knowledge_base(), daemon=True).start()
+    # Load ngay lập tức khi startup (incremental nhờ manifest từ snapshot local)
+    def _initial_load():
+        try:
+            load_qa_knowledge_base()
+        finally:
+            kb_ready.set()
+    threading.Thread(target=_initial_load, daemon=True).start()
     # Khởi động auto-reload thread
     start_auto_reload_background_thread()
     # Khởi động auto-learning thread (tự học chủ động)
@@ -296,5 +911,7 @@ if settings.boto3 and (settings.s3_client or settings.ddb_client):
         start_auto_learning_background_thread()
     except Exception as e:
         print(f"[WARN] Failed to start auto-learning: {e}")
+else:
+    kb_ready.set()
 
 
@@ -1,10 +1,15 @@
 import re
-from typing import Generator
+import time
+from collections import deque
+from typing import Generator, Iterable, List, Optional
 from .gemini import call_gemini, call_gemini_stream
 from .ollama import call_ollama, call_ollama_stream
-from .kb import find_best_local_answer
+from .kb import find_best_local_match, get_snapshot
 from .prompts import enrich_context, get_system_context
-from .cache import get_cached_response, cache_response
+from .cache import (
+    get_cached_response, get_cached_chunks, cache_response, get_cache_key,
+)
+from .singleflight import SingleFlight
 from .validation import validate_response, sanitize_response
 from . import settings
 
@@ -15,11 +20,93 @@ _metrics = {
     'ollama_calls': 0,
     'gemini_calls': 0,
     'fallbacks': 0,
+    'coalesced_calls': 0,
+    'coalesced_streams': 0,
 }
 
+# Gộp các request trùng cache key đang chờ model
+_inflight = SingleFlight(timeout=settings.REQUEST_COALESCING_TIMEOUT)
+
+# Time-to-first-byte của stream (ms), tách theo cache hit và stream trực tiếp từ model
+TTFB_SAMPLES = 1000
+REPLAY_CHUNK_SIZE = 20  # Cắt response không có ranh giới chunk khi replay theo nhịp
+_stream_ttfb = {
+    'cache': deque(maxlen=TTFB_SAMPLES),
+    'live': deque(maxlen=TTFB_SAMPLES),
+}
+
+
+def _ttfb_summary() -> dict:
+    summary = {}
+    for path, samples in _stream_ttfb.items():
+        values = sorted(samples)
+        if not values:
+            continue
+        summary[path] = {
+            'p50_ms': round(values[int(0.50 * (len(values) - 1))], 3),
+            'p99_ms': round(values[int(0.99 * (len(values) - 1))], 3),
+            'samples': len(values),
+        }
+    return summary
+
 
 def get_logic_metrics() -> dict:
-    return dict(_metrics)
+    metrics = dict(_metrics)
+    metrics['stream_ttfb'] = _ttfb_summary()
+    return metrics
+
+
+def _record_ttfb(chunks: Iterable[str], path: str, start: float) -> Generator[str, None, Optional[str]]:
+    """Yield lại các chunk, ghi nhận thời gian tới chunk đầu tiên; trả về giá trị return của `chunks`."""
+    first = True
+    iterator = iter(chunks)
+    while True:
+        try:
+            chunk = next(iterator)
+        except StopIteration as stop:
+            return stop.value
+        if first:
+            _stream_ttfb[path].append((time.perf_counter() - start) * 1000)
+            first = False
+        yield chunk
+
+
+def _sanitized_chunks(parts: List[str], full_response: str, sanitized: str):
+    """
+    Ranh giới chunk cho response đã sanitize: giữ nguyên nếu nội dung không đổi hoặc chỉ bị
+    strip khoảng trắng hai đầu; None nếu sanitize cắt bỏ nội dung bên trong.
+    """
+    if sanitized == full_response:
+        return parts
+    if not sanitized or sanitized != full_response.strip():
+        return None
+    chunks = []
+    pos = -(len(full_response) - len(full_response.lstrip()))
+    for part in parts:
+        begin = max(pos, 0)
+        pos += len(part)
+        end = min(pos, len(sanitized))
+        if end > begin:
+            chunks.append(sanitized[begin:end])
+    return chunks
+
+
+def _replay_chunks(chunks: List[str]) -> Generator[str, None, None]:
+    """
+    Replay cached response: STREAM_CACHE_REPLAY_DELAY_MS <= 0 thì flush một lần,
+    ngược lại yield từng chunk đã lưu (hoặc từng đoạn REPLAY_CHUNK_SIZE ký tự) theo nhịp đó.
+    """
+    delay = settings.STREAM_CACHE_REPLAY_DELAY_MS / 1000
+    if delay <= 0:
+        yield ''.join(chunks)
+        return
+    if len(chunks) == 1:
+        text = chunks[0]
+        chunks = [text[i:i + REPLAY_CHUNK_SIZE] for i in range(0, len(text), REPLAY_CHUNK_SIZE)]
+    for i, chunk in enumerate(chunks):
+        if i:
+            time.sleep(delay)
+        yield chunk
 
 
 def process_message(
@@ -44,9 +131,9 @@ def process_message(
     message_lower = message.lower().strip()
     message_clean = re.sub(r"[!?.]", "", message_lower)
 
-    # 1. Kiểm tra cache trước
+    # 1. Kiểm tra cache trước (chỉ L1 khớp chính xác; L2 và tier semantic chỉ xét sau khi KB không trả lời được)
     if settings.ENABLE_RESPONSE_CACHE and not bypass_kb:
-        cached = get_cached_response(message, context)
+        cached = get_cached_response(message, context, shared=False, semantic=False)
         if cached:
             _metrics['cache_hits'] += 1
             return {
@@ -57,19 +144,32 @@ def process_message(
             }
 
     # 2. Kiểm tra knowledge base
+    kb_version = None
     if not bypass_kb:
-        kb_ans = find_best_local_answer(message)
-        if kb_ans:
+        kb_version = get_snapshot().version
+        kb_match = find_best_local_match(message)
+        if kb_match:
+            kb_ans = kb_match['a']
             _metrics['kb_hits'] += 1
-            # Cache KB answer
+            # Cache KB answer (gắn câu hỏi KB đã khớp để invalidate khi KB thay đổi)
             if settings.ENABLE_RESPONSE_CACHE:
-                cache_response(message, context, kb_ans)
+                cache_response(message, context, kb_ans, source='kb', kb_version=kb_match['version'], kb_question=kb_match['q'])
             return {
                 'response': kb_ans,
                 'from_cache': False,
                 'validation': {'valid': True, 'score': 1.0},
                 'source': 'kb'
             }
+        if settings.ENABLE_RESPONSE_CACHE:
+            similar = get_cached_response(message, context, exact=False, kb_version=kb_version)
+            if similar:
+                _metrics['cache_hits'] += 1
+                return {
+                    'response': similar,
+                    'from_cache': True,
+                    'validation': {'valid': True, 'score': 1.0},
+                    'source': 'cache'
+                }
 
     # 3. Xử lý các pattern chung chung
     if re.fullmatch(r"(xin chào|chào|chào bạn|hello|hi)", message_clean):
@@ -97,6 +197,24 @@ def process_message(
             'source': 'fallback'
         }
 
+    # 4-7. Gọi model; request trùng đang in-flight thì dùng chung kết quả
+    if settings.ENABLE_REQUEST_COALESCING and not bypass_kb:
+        result, shared = _inflight.do(
+            get_cache_key(message, context),
+            lambda: _call_model(message, context, history, system_info, kb_version),
+        )
+        if shared:
+            _metrics['coalesced_calls'] += 1
+            return dict(result)
+        return result
+    return _call_model(message, context, history, system_info, kb_version)
+
+
+def _call_model(message: str, context: str, history: list, system_info: dict, kb_version: int = None) -> dict:
+    """
+    Gọi Ollama/Gemini, sanitize + validate và cache kết quả.
+    `kb_version` là snapshot KB đã không khớp message: KB publish version mới trong lúc chờ model thì không cache.
+    """
     # 4. Enrich context với system prompt và system info
     enriched_context = enrich_context(context or get_system_context(), system_info)
 
@@ -138,7 +256,7 @@ def process_message(
 
     # 7. Cache response nếu hợp lệ
     if settings.ENABLE_RESPONSE_CACHE and validation.get('valid', False) and source in ['ollama', 'gemini']:
-        cache_response(message, context, response_text)
+        cache_response(message, context, response_text, source=source, kb_version=kb_version)
 
     return {
         'response': response_text,
@@ -154,7 +272,8 @@ def process_message_stream(
     bypass_kb: bool = False,
     session_id: str = None,
     history: list = None,
-    system_info: dict = None
+    system_info: dict = None,
+    meta: dict = None
 ) -> Generator[str, None, None]:
     """
     Process message với streaming mode - trả về generator để stream trực tiếp từ AI.
@@ -166,37 +285,52 @@ def process_message_stream(
         session_id: Session ID for memory
         history: Conversation history
         system_info: System info/metadata
+        meta: Nếu có, được ghi 'source' ('kb'|'cache'|'ollama'|'gemini'|'fallback') và 'from_cache'
+            khi stream xong
     
     Yields:
         str: Chunks of text as they come from the AI model
     """
+    start = time.perf_counter()
     message_lower = message.lower().strip()
     message_clean = re.sub(r"[!?.]", "", message_lower)
+    if meta is None:
+        meta = {}
+    meta.update(source='fallback', from_cache=False)
     
-    # 1. Kiểm tra cache (không stream cache, trả về ngay)
+    # 1. Kiểm tra cache (chỉ L1 khớp chính xác): replay các chunk đã lưu (flush một lần hoặc theo nhịp cấu hình)
     if settings.ENABLE_RESPONSE_CACHE and not bypass_kb:
-        cached = get_cached_response(message, context)
-        if cached:
+        cached_chunks = get_cached_chunks(message, context, shared=False, semantic=False)
+        if cached_chunks and any(cached_chunks):
             _metrics['cache_hits'] += 1
-            # Yield cached response in chunks to maintain streaming behavior
-            chunk_size = 20
-            for i in range(0, len(cached), chunk_size):
-                yield cached[i:i+chunk_size]
+            meta.update(source='cache', from_cache=True)
+            yield from _record_ttfb(_replay_chunks(cached_chunks), 'cache', start)
             return
     
     # 2. Kiểm tra knowledge base (không stream KB, trả về ngay)
+    kb_version = None
     if not bypass_kb:
-        kb_ans = find_best_local_answer(message)
-        if kb_ans:
+        kb_version = get_snapshot().version
+        kb_match = find_best_local_match(message)
+        if kb_match:
+            kb_ans = kb_match['a']
             _metrics['kb_hits'] += 1
+            meta['source'] = 'kb'
             # Yield KB answer in chunks
             chunk_size = 20
             for i in range(0, len(kb_ans), chunk_size):
                 yield kb_ans[i:i+chunk_size]
             # Cache KB answer
             if settings.ENABLE_RESPONSE_CACHE:
-                cache_response(message, context, kb_ans)
+                cache_response(message, context, kb_ans, source='kb', kb_version=kb_match['version'], kb_question=kb_match['q'])
             return
+        if settings.ENABLE_RESPONSE_CACHE:
+            similar_chunks = get_cached_chunks(message, context, exact=False, kb_version=kb_version)
+            if similar_chunks and any(similar_chunks):
+                _metrics['cache_hits'] += 1
+                meta.update(source='cache', from_cache=True)
+                yield from _record_ttfb(_replay_chunks(similar_chunks), 'cache', start)
+                return
     
     # 3. Xử lý các pattern chung chung (fallback patterns)
     if re.fullmatch(r"(xin chào|chào|chào bạn|hello|hi)", message_clean):
@@ -220,6 +354,27 @@ def process_message_stream(
             yield response[i:i+chunk_size]
         return
     
+    # 4-5. Stream từ model; request trùng đang in-flight thì nhận chung luồng chunk
+    if settings.ENABLE_REQUEST_COALESCING and not bypass_kb:
+        chunks, shared = _inflight.stream(
+            get_cache_key(message, context),
+            lambda: _stream_model(message, context, history, system_info, kb_version),
+        )
+        if shared:
+            _metrics['coalesced_streams'] += 1
+        # Follower nhận nguồn câu trả lời của leader (giá trị return của _stream_model)
+        meta['source'] = (yield from _record_ttfb(chunks, 'live', start)) or 'fallback'
+        return
+    meta['source'] = (yield from _record_ttfb(_stream_model(message, context, history, system_info, kb_version), 'live', start)) or 'fallback'
+
+
+def _stream_model(
+    message: str, context: str, history: list, system_info: dict, kb_version: int = None
+) -> Generator[str, None, str]:
+    """
+    Stream từ Ollama/Gemini (hoặc fallback message) và cache response đầy đủ (xem `kb_version` ở _call_model).
+    Trả về nguồn câu trả lời ('ollama'|'gemini'|'fallback').
+    """
     # 4. Enrich context với system prompt và system info
     enriched_context = enrich_context(context or get_system_context(), system_info)
     
@@ -247,17 +402,20 @@ def process_message_stream(
     
     # Stream từ generator nếu có
     if stream_generator:
-        full_response = ""
+        parts = []
         for chunk in stream_generator:
-            full_response += chunk
+            parts.append(chunk)
             yield chunk
         
         # Sanitize full response after streaming
+        full_response = ''.join(parts)
         if full_response:
             sanitized = sanitize_response(full_response)
             # Nếu sanitized khác với full_response, cần validate
             if settings.ENABLE_RESPONSE_CACHE and source in ['ollama', 'gemini']:
-                cache_response(message, context, sanitized)
+                cache_response(message, context, sanitized, _sanitized_chunks(parts, full_response, sanitized),
+                               source=source, kb_version=kb_version)
+        return source
     else:
         # Fallback message nếu không có AI nào available
         response_text = "Cảm ơn bạn đã liên hệ! Tôi là trợ lý AI của hệ thống Quản lý Nhân khẩu. Bạn có thể hỏi tôi về bất kỳ tính năng nào của hệ thống."
@@ -265,5 +423,4 @@ def process_message_stream(
         chunk_size = 20
         for i in range(0, len(response_text), chunk_size):
             yield response_text[i:i+chunk_size]
-
-
+        return 'fallback'
@@ -2,21 +2,184 @@
 Conversation Memory - Lưu trữ và quản lý conversation history
 """
 
+import sys
 import threading
 import time
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict
-from collections import defaultdict
+from collections import deque
+from datetime import datetime
+from enum import IntEnum
+from itertools import islice
+from typing import Deque, Optional, List, Dict, Set
 
-# In-memory storage (có thể nâng cấp lên Redis/DB sau)
-conversation_sessions: Dict[str, List[Dict]] = defaultdict(list)  # session_id -> list of messages
-session_last_activity: Dict[str, datetime] = {}  # session_id -> last activity time
-memory_lock = threading.Lock()
+from . import settings
+from .session_backends import create_session_backend
 
 # Config
-SESSION_TIMEOUT_HOURS = 24  # Session timeout sau 24h không hoạt động
+SESSION_TIMEOUT_HOURS = settings.SESSION_TIMEOUT_HOURS  # Session timeout sau N giờ không hoạt động (mặc định 24h)
 MAX_MESSAGES_PER_SESSION = 50  # Giới hạn số messages trong 1 session
-CLEANUP_INTERVAL_SECONDS = 3600  # Cleanup mỗi giờ
+CLEANUP_INTERVAL_SECONDS = 60  # Mỗi phút hết hạn các bucket đã quá timeout
+SESSION_MAX_COUNT = settings.SESSION_MAX_COUNT  # Tổng số session tối đa (0 = không giới hạn)
+SESSION_MAX_BYTES = settings.SESSION_MAX_BYTES  # Tổng bytes ước lượng tối đa (0 = không giới hạn)
+
+
+class Role(IntEnum):
+    USER = 0
+    ASSISTANT = 1
+    SYSTEM = 2
+
+
+class Message:
+    """Một message trong history: role dạng enum, thời gian dạng epoch (float)."""
+
+    __slots__ = ('role', 'content', 'created_at')
+
+    def __init__(self, role: Role, content: str, created_at: float):
+        self.role = role
+        self.content = content
+        self.created_at = created_at
+
+    def nbytes(self) -> int:
+        """Ước lượng bộ nhớ của message (object + content)."""
+        return _MESSAGE_OVERHEAD_BYTES + sys.getsizeof(self.content)
+
+    def to_dict(self) -> Dict:
+        return {
+            'role': self.role.name.lower(),
+            'content': self.content,
+            'timestamp': datetime.fromtimestamp(self.created_at).isoformat(),
+        }
+
+
+_MESSAGE_OVERHEAD_BYTES = sys.getsizeof(Message(Role.USER, '', 0.0)) + sys.getsizeof(0.0) + 8  # + slot trong deque
+_SESSION_OVERHEAD_BYTES = sys.getsizeof(deque(maxlen=MAX_MESSAGES_PER_SESSION)) + 200  # deque + entries trong các dict/bucket
+
+
+def _new_history() -> Deque[Message]:
+    # Ring buffer: append khi đầy tự bỏ message cũ nhất, O(1)
+    return deque(maxlen=MAX_MESSAGES_PER_SESSION)
+
+
+class _Shard:
+    """
+    Một phân vùng session với lock riêng.
+
+    Timing wheel: `wheel` nhóm session theo phút hoạt động cuối (epoch // 60). Mỗi lần hoạt động
+    session chuyển sang bucket của phút hiện tại, nên khi một bucket quá timeout thì mọi session
+    trong đó đều đã idle và có thể xóa mà không cần quét các session khác.
+    """
+
+    __slots__ = ('lock', 'sessions', 'last_activity', 'wheel', 'nbytes', 'expired', 'evicted', 'evicted_bytes')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions: Dict[str, Deque[Message]] = {}  # session_id -> ring buffer messages
+        self.last_activity: Dict[str, float] = {}  # session_id -> last activity (epoch)
+        self.wheel: Dict[int, Set[str]] = {}  # phút hoạt động cuối -> session_ids
+        self.nbytes = 0  # Ước lượng bytes của các session trong shard
+        self.expired = 0  # Số session đã hết hạn (cộng dồn)
+        self.evicted = 0  # Số session bị đẩy ra do vượt budget (cộng dồn)
+        self.evicted_bytes = 0
+
+    def touch(self, session_id: str, now: float) -> None:
+        """Cập nhật hoạt động cuối và chuyển bucket nếu sang phút mới (gọi khi giữ lock)."""
+        minute = int(now // 60)
+        previous = self.last_activity.get(session_id)
+        if previous is not None:
+            old_minute = int(previous // 60)
+            if old_minute == minute:
+                self.last_activity[session_id] = now
+                return
+            bucket = self.wheel.get(old_minute)
+            if bucket is not None:
+                bucket.discard(session_id)
+                if not bucket:
+                    del self.wheel[old_minute]
+        else:
+            self.sessions.setdefault(session_id, _new_history())
+            self.nbytes += _SESSION_OVERHEAD_BYTES
+        self.last_activity[session_id] = now
+        self.wheel.setdefault(minute, set()).add(session_id)
+
+    def remove(self, session_id: str) -> bool:
+        """Xóa session khỏi shard (gọi khi giữ lock)."""
+        last = self.last_activity.pop(session_id, None)
+        history = self.sessions.pop(session_id, None)
+        if last is None:
+            return False
+        bucket = self.wheel.get(int(last // 60))
+        if bucket is not None:
+            bucket.discard(session_id)
+            if not bucket:
+                del self.wheel[int(last // 60)]
+        self.nbytes -= _SESSION_OVERHEAD_BYTES
+        if history:
+            self.nbytes -= sum(m.nbytes() for m in history)
+        return True
+
+    def expire(self, cutoff_minute: int) -> int:
+        """Xóa mọi session trong các bucket có phút <= cutoff_minute (gọi khi giữ lock)."""
+        removed = 0
+        for minute in [m for m in self.wheel if m <= cutoff_minute]:
+            for session_id in list(self.wheel.get(minute, ())):
+                if self.remove(session_id):
+                    removed += 1
+        self.expired += removed
+        return removed
+
+    def session_nbytes(self, session_id: str) -> int:
+        history = self.sessions.get(session_id)
+        return _SESSION_OVERHEAD_BYTES + (sum(m.nbytes() for m in history) if history else 0)
+
+    def _oldest_session(self, keep: str) -> Optional[str]:
+        """
+        Session hoạt động cuối sớm nhất (khác `keep`): bucket phút cũ nhất rồi last_activity nhỏ nhất
+        trong bucket, vì trong một đợt crawler mọi session cùng nằm ở bucket của phút hiện tại.
+        """
+        if not self.wheel:
+            return None
+        buckets = [self.wheel[min(self.wheel)]]
+        if len(buckets[0]) == 1 and keep in buckets[0]:
+            # Bucket cũ nhất chỉ có session đang dùng -> xét các bucket tiếp theo
+            buckets = [self.wheel[minute] for minute in sorted(self.wheel)[1:2]]
+        candidates = [sid for bucket in buckets for sid in bucket if sid != keep]
+        if not candidates:
+            return None
+        return min(candidates, key=self.last_activity.__getitem__)
+
+    def enforce_budget(self, max_count: int, max_bytes: int, keep: str) -> None:
+        """
+        Đẩy ra các session idle lâu nhất (bucket phút cũ nhất của timing wheel) cho tới khi shard
+        nằm trong budget; không đẩy session `keep` đang được dùng (gọi khi giữ lock).
+        """
+        while ((max_count and len(self.last_activity) > max_count)
+               or (max_bytes and self.nbytes > max_bytes)):
+            victim = self._oldest_session(keep)
+            if victim is None:
+                return
+            nbytes = self.session_nbytes(victim)
+            self.remove(victim)
+            self.evicted += 1
+            self.evicted_bytes += nbytes
+
+
+# In-memory storage (có thể nâng cấp lên Redis/DB sau), chia theo hash(session_id)
+# để các request của session khác nhau không chờ chung một lock
+SESSION_SHARDS = max(1, settings.SESSION_SHARDS)
+_shards: List[_Shard] = [_Shard() for _ in range(SESSION_SHARDS)]
+
+
+def _shard_for(session_id: str) -> _Shard:
+    return _shards[hash(session_id) % SESSION_SHARDS]
+
+
+# Budget toàn cục chia đều cho các shard: mỗi shard tự đẩy session trong lock của nó,
+# hash(session_id) phân bố đều nên tổng xấp xỉ budget mà không cần lock chung
+_shard_max_count = -(-SESSION_MAX_COUNT // SESSION_SHARDS) if SESSION_MAX_COUNT > 0 else 0
+_shard_max_bytes = -(-SESSION_MAX_BYTES // SESSION_SHARDS) if SESSION_MAX_BYTES > 0 else 0
+
+
+# Session store dùng chung giữa các worker (SESSION_BACKEND=sqlite); None = dict trong process
+session_backend = create_session_backend(MAX_MESSAGES_PER_SESSION)
 
 
 def get_or_create_session(session_id: Optional[str] = None) -> str:
@@ -25,10 +188,14 @@ def get_or_create_session(session_id: Optional[str] = None) -> str:
         # Tạo session ID mới dựa trên timestamp
         session_id = f"session_{int(time.time() * 1000)}"
     
-    with memory_lock:
-        if session_id not in session_last_activity:
-            conversation_sessions[session_id] = []
-        session_last_activity[session_id] = datetime.now()
+    if session_backend is not None:
+        session_backend.touch(session_id)
+        return session_id
+    
+    shard = _shard_for(session_id)
+    with shard.lock:
+        shard.touch(session_id, time.time())
+        shard.enforce_budget(_shard_max_count, _shard_max_bytes, keep=session_id)
     
     return session_id
 
@@ -42,21 +209,23 @@ def add_message(session_id: str, role: str, content: str) -> None:
         role: 'user' hoặc 'assistant'
         content: Nội dung message
     """
-    with memory_lock:
-        if session_id not in conversation_sessions:
-            conversation_sessions[session_id] = []
-        
-        # Giới hạn số lượng messages
-        if len(conversation_sessions[session_id]) >= MAX_MESSAGES_PER_SESSION:
-            # Giữ lại các messages gần nhất
-            conversation_sessions[session_id] = conversation_sessions[session_id][-MAX_MESSAGES_PER_SESSION+1:]
+    now = time.time()
+    message = Message(Role[role.upper()], content, now)
+    if session_backend is not None:
+        session_backend.append(session_id, int(message.role), content, now)
+        return
+    
+    shard = _shard_for(session_id)
+    with shard.lock:
+        shard.touch(session_id, now)
+        history = shard.sessions[session_id]
         
-        conversation_sessions[session_id].append({
-            'role': role,
-            'content': content,
-            'timestamp': datetime.now().isoformat()
-        })
-        session_last_activity[session_id] = datetime.now()
+        # deque(maxlen) tự bỏ message cũ nhất khi đầy, giữ lại MAX_MESSAGES_PER_SESSION messages gần nhất
+        if len(history) == history.maxlen:
+            shard.nbytes -= history[0].nbytes()
+        history.append(message)
+        shard.nbytes += message.nbytes()
+        shard.enforce_budget(_shard_max_count, _shard_max_bytes, keep=session_id)
 
 
 def get_conversation_history(session_id: str, max_messages: int = 10) -> List[Dict]:
@@ -70,42 +239,94 @@ def get_conversation_history(session_id: str, max_messages: int = 10) -> List[Di
     Returns:
         List of messages: [{'role': str, 'content': str, 'timestamp': str}, ...]
     """
-    with memory_lock:
-        if session_id not in conversation_sessions:
+    if session_backend is not None:
+        if max_messages <= 0:
+            return []
+        return [Message(Role(role), content, created_at).to_dict()
+                for role, content, created_at in session_backend.tail(session_id, max_messages)]
+    
+    shard = _shard_for(session_id)
+    with shard.lock:
+        messages = shard.sessions.get(session_id)
+        if not messages or max_messages <= 0:
             return []
         
-        messages = conversation_sessions[session_id]
-        # Trả về các messages gần nhất
-        return messages[-max_messages:] if len(messages) > max_messages else messages
+        # Chỉ lấy phần đuôi: duyệt ngược max_messages phần tử, không copy cả session
+        tail = list(islice(reversed(messages), max_messages))
+    tail.reverse()
+    return [m.to_dict() for m in tail]
 
 
 def clear_session(session_id: str) -> None:
     """Xóa conversation history của session."""
-    with memory_lock:
-        if session_id in conversation_sessions:
-            del conversation_sessions[session_id]
-        if session_id in session_last_activity:
-            del session_last_activity[session_id]
+    if session_backend is not None:
+        session_backend.delete(session_id)
+        return
+    
+    shard = _shard_for(session_id)
+    with shard.lock:
+        shard.remove(session_id)
 
 
 def cleanup_expired_sessions() -> None:
-    """Xóa các session đã hết hạn."""
-    now = datetime.now()
-    expired_sessions = []
+    """
+    Hết hạn các bucket của timing wheel đã quá SESSION_TIMEOUT_HOURS, lần lượt từng shard
+    (chỉ giữ lock của shard đang xử lý, chỉ chạm tới các session thực sự idle).
+    """
+    if session_backend is not None:
+        total = session_backend.expire(time.time() - SESSION_TIMEOUT_HOURS * 3600)
+        if total:
+            print(f"[Memory] Cleaned up {total} expired sessions")
+        return
     
-    with memory_lock:
-        for session_id, last_activity in list(session_last_activity.items()):
-            if now - last_activity > timedelta(hours=SESSION_TIMEOUT_HOURS):
-                expired_sessions.append(session_id)
-        
-        for session_id in expired_sessions:
-            if session_id in conversation_sessions:
-                del conversation_sessions[session_id]
-            if session_id in session_last_activity:
-                del session_last_activity[session_id]
+    timeout_minutes = SESSION_TIMEOUT_HOURS * 60
+    total = 0
+    
+    for shard in _shards:
+        # Bucket phút m chứa session hoạt động cuối trong [m, m+1) phút -> hết hạn khi m + 1 + timeout <= now
+        cutoff_minute = int(time.time() // 60) - timeout_minutes - 1
+        with shard.lock:
+            total += shard.expire(cutoff_minute)
+    
+    if total:
+        print(f"[Memory] Cleaned up {total} expired sessions")
+
+
+def get_session_stats() -> Dict:
+    """Thống kê session store: số session live, đã hết hạn và bytes ước lượng."""
+    if session_backend is not None:
+        stats = session_backend.stats()
+        stats.update(timeout_hours=SESSION_TIMEOUT_HOURS, cleanup_interval_seconds=CLEANUP_INTERVAL_SECONDS)
+        return stats
     
-    if expired_sessions:
-        print(f"[Memory] Cleaned up {len(expired_sessions)} expired sessions")
+    live = 0
+    expired = 0
+    evicted = 0
+    evicted_bytes = 0
+    nbytes = 0
+    buckets = 0
+    for shard in _shards:
+        with shard.lock:
+            live += len(shard.last_activity)
+            expired += shard.expired
+            evicted += shard.evicted
+            evicted_bytes += shard.evicted_bytes
+            nbytes += shard.nbytes
+            buckets += len(shard.wheel)
+    return {
+        'backend': 'memory',
+        'live_sessions': live,
+        'expired_sessions': expired,
+        'evicted_sessions': evicted,
+        'evicted_bytes': evicted_bytes,
+        'approx_bytes': nbytes,
+        'max_sessions': SESSION_MAX_COUNT,
+        'max_bytes': SESSION_MAX_BYTES,
+        'shards': SESSION_SHARDS,
+        'wheel_buckets': buckets,
+        'timeout_hours': SESSION_TIMEOUT_HOURS,
+        'cleanup_interval_seconds': CLEANUP_INTERVAL_SECONDS,
+    }
 
 
 def start_cleanup_thread():
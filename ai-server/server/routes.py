@@ -3,11 +3,12 @@ from flask import jsonify, request, Response, stream_with_context
 
 from .app import app
 from . import settings
-from .kb import find_best_local_answer, trigger_reload, get_kb_status
+from .kb import find_best_local_answer, trigger_reload, get_kb_status, search_batch
 from .logic import process_message, process_message_stream, get_logic_metrics
 from .actions import infer_actions
 from .utils import get_timestamp, persist_chat_event
-from .memory import get_or_create_session, add_message, get_conversation_history, clear_session
+from .cache_warmup import get_warmup_status
+from .memory import get_or_create_session, add_message, get_conversation_history, clear_session, get_session_stats
 SESSION_COOKIE_NAME = "ai_session_id"
 SESSION_COOKIE_MAX_AGE = settings.SESSION_TIMEOUT_HOURS * 3600
 
@@ -147,8 +148,10 @@ def chat():
         # Streaming mode: stream trực tiếp từ AI models
         def generate_streamed_response():
             full_response = ""
+            response_parts = []
             stream_source = 'unknown'
             stream_from_cache = False
+            stream_meta = {}
             
             try:
                 # Nếu có actions, không cần stream
@@ -181,14 +184,16 @@ def chat():
                     bypass_kb=False,
                     session_id=session_id,
                     history=history,
-                    system_info=system_info
+                    system_info=system_info,
+                    meta=stream_meta
                 ):
-                    full_response += chunk
+                    response_parts.append(chunk)
                     yield f"data: {chunk}\n\n"
+                full_response = ''.join(response_parts)
                 
-                # Xác định source từ full response (đơn giản hóa)
-                # Trong thực tế, bạn có thể thêm metadata vào stream
-                stream_source = 'ollama' if settings.OLLAMA_HOST and settings.OLLAMA_MODEL else 'gemini' if settings.GOOGLE_GEMINI_API_KEY else 'fallback'
+                # Nguồn thực tế của câu trả lời (kb/cache/ollama/gemini/fallback) do process_message_stream ghi lại
+                stream_source = stream_meta.get('source', 'unknown')
+                stream_from_cache = stream_meta.get('from_cache', False)
                 
                 # Lưu vào conversation memory sau khi stream xong
                 if settings.ENABLE_CONVERSATION_MEMORY and session_id:
@@ -272,7 +277,7 @@ def agent_plan():
 
 @app.route('/qa-feedback', methods=['POST'])
 def qa_feedback():
-    from .kb import qa_knowledge_base, kb_lock  # local import to avoid circular
+    from .kb import upsert_item, remove_item  # local import to avoid circular
     try:
         data = request.json or {}
         question = (data.get('question') or '').strip()
@@ -288,17 +293,14 @@ def qa_feedback():
             # Thực hiện quá trình học và cập nhật KB ở background để không chặn phản hồi hiện tại
             import threading
             def background_learn_wrong(q: str, ctx: str):
-                from .kb import qa_knowledge_base, kb_lock  # re-import inside thread context
                 from .ollama import call_ollama
                 from .gemini import call_gemini
                 # Loại bỏ câu trả lời cũ nếu có
-                with kb_lock:
-                    qa_knowledge_base[:] = [it for it in qa_knowledge_base if it['q'].strip().lower() != q.strip().lower()]
+                remove_item(q)
                 # Sinh câu trả lời mới từ mô hình
                 generated = call_ollama(q, ctx) or call_gemini(q, ctx)
                 if generated:
-                    with kb_lock:
-                        qa_knowledge_base.append({'q': q, 'a': generated})
+                    upsert_item(q, generated)
                     persist_chat_event({
                         'timestamp': get_timestamp(),
                         'message': q,
@@ -317,16 +319,7 @@ def qa_feedback():
         elif feedback_type in ('confirm', 'correct'):
             if not answer:
                 return jsonify({"error": "answer is required for confirm/correct"}), 400
-            new_item = {'q': question, 'a': answer}
-            with kb_lock:
-                found = False
-                for idx, it in enumerate(qa_knowledge_base):
-                    if it['q'].strip().lower() == question.strip().lower():
-                        qa_knowledge_base[idx] = new_item
-                        found = True
-                        break
-                if not found:
-                    qa_knowledge_base.append(new_item)
+            upsert_item(question, answer)
             persist_chat_event({
                 'timestamp': get_timestamp(),
                 'message': question,
@@ -353,16 +346,18 @@ def qa_feedback():
 
 @app.route('/kb/reload', methods=['POST'])
 def kb_reload():
-    """Endpoint để trigger reload knowledge base thủ công."""
+    """Endpoint để trigger reload knowledge base thủ công (?full=true để tải lại toàn bộ S3)."""
     try:
-        result = trigger_reload()
+        full = str(request.args.get('full', 'false')).lower() == 'true'
+        result = trigger_reload(force=full)
         if result['success']:
             return jsonify({
                 "success": True,
                 "message": "Knowledge base reloaded successfully",
                 "items_count": result['items_count'],
                 "previous_count": result['previous_count'],
-                "timestamp": result['timestamp']
+                "timestamp": result['timestamp'],
+                "fetch": result.get('fetch')
             })
         else:
             return jsonify({
@@ -385,6 +380,7 @@ def kb_status():
             status['auto_learning'] = auto_learning_status
         # Thêm logic metrics
         status['logic_metrics'] = get_logic_metrics()
+        status['session_memory'] = get_session_stats()
         return jsonify({
             "success": True,
             "status": status
@@ -393,6 +389,63 @@ def kb_status():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/kb/search', methods=['POST'])
+def kb_search():
+    """
+    Tìm top-k câu trả lời trong knowledge base cho một lô câu hỏi (kèm điểm từng tín hiệu).
+    Dùng để tinh chỉnh ngưỡng offline hoặc làm bộ lọc rẻ trước các service khác.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "request body must be a JSON object"}), 400
+        queries = data.get('queries')
+        if queries is None and data.get('query'):
+            queries = [data.get('query')]
+        if not isinstance(queries, list) or not queries or not all(isinstance(q, str) for q in queries):
+            return jsonify({"error": "queries must be a non-empty list of strings"}), 400
+        if len(queries) > settings.KB_SEARCH_MAX_QUERIES:
+            return jsonify({"error": f"at most {settings.KB_SEARCH_MAX_QUERIES} queries per request"}), 400
+
+        k = max(1, min(int(data.get('k', settings.KB_TOP_K)), settings.KB_SEARCH_MAX_K))
+        threshold = data.get('threshold')
+        jaccard_threshold = data.get('jaccard_threshold')
+        result = search_batch(
+            queries,
+            k=k,
+            threshold=float(threshold) if threshold is not None else None,
+            jaccard_threshold=float(jaccard_threshold) if jaccard_threshold is not None else None,
+        )
+
+        results = []
+        for query, matches in zip(queries, result['results']):
+            results.append({
+                "query": query,
+                "matches": [
+                    {
+                        "question": m['q'],
+                        "answer": m['a'],
+                        "seq": m.get('seq'),
+                        "jaccard": m.get('jaccard'),
+                        "bm25": m.get('bm25'),
+                        "combined": m['score'],
+                    }
+                    for m in matches
+                ]
+            })
+        return jsonify({
+            "success": True,
+            "mode": settings.KB_RETRIEVAL_MODE,
+            "kb_version": result['version'],
+            "k": k,
+            "results": results
+        })
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"invalid parameter: {e}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/kb/auto-learn', methods=['POST'])
 def kb_auto_learn():
     """Endpoint để trigger tự học chủ động ngay lập tức."""
@@ -443,6 +496,18 @@ def kb_auto_learn_status():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/session/stats', methods=['GET'])
+def session_stats():
+    """Thống kê session store (live/expired sessions, bytes ước lượng)."""
+    try:
+        return jsonify({
+            "success": True,
+            "stats": get_session_stats()
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @app.route('/session/<session_id>', methods=['DELETE'])
 def clear_session_route(session_id: str):
     """Xóa conversation history của session."""
@@ -477,6 +542,7 @@ def cache_stats():
     """Xem thống kê cache."""
     try:
         stats = get_cache_stats()
+        stats['warmup'] = get_warmup_status()
         return jsonify({
             "success": True,
             "stats": stats
@@ -0,0 +1,128 @@
+"""
+S3 chat logs - Liệt kê và tải song song các file chat log (ndjson) trên S3
+Dùng chung cho kb (load knowledge base) và auto_learning
+"""
+
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from . import settings
+
+T = TypeVar('T')
+
+LOG_SUFFIXES = ('.ndjson', '.ndjson.gz')
+
+
+def list_log_objects(prefix: Optional[str] = None) -> List[Dict]:
+    """
+    Liệt kê các file chat log (.ndjson hoặc .ndjson.gz) dưới prefix (mặc định LEARNING_S3_PREFIX).
+
+    Returns:
+        List các object từ list_objects_v2 ({'Key', 'ETag', 'Size', 'LastModified', ...}),
+        theo thứ tự key (YYYY/MM/DD -> cũ đến mới)
+    """
+    prefix = prefix if prefix is not None else f"{settings.LEARNING_S3_PREFIX}/"
+    paginator = settings.s3_client.get_paginator('list_objects_v2')
+    objects = []
+    for page in paginator.paginate(Bucket=settings.AWS_S3_BUCKET, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if obj['Key'].endswith(LOG_SUFFIXES):
+                objects.append(obj)
+    return objects
+
+
+def iter_ndjson_events(body, compressed: bool = False) -> Iterator[Dict]:
+    """
+    Đọc stream ndjson (botocore StreamingBody hoặc file-like) và yield từng event đã parse.
+
+    Không đọc toàn bộ body vào bộ nhớ; các dòng rỗng, không phải JSON object
+    hoặc lỗi encoding được bỏ qua.
+
+    Args:
+        body: Stream có .read() (và .iter_lines() nếu là StreamingBody)
+        compressed: True nếu body là gzip
+    """
+    if compressed:
+        lines = gzip.GzipFile(fileobj=body, mode='rb')
+    elif hasattr(body, 'iter_lines'):
+        lines = body.iter_lines()
+    else:
+        lines = iter(body.readline, b'')
+    for raw in lines:
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            ev = json.loads(raw.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            continue
+        if isinstance(ev, dict):
+            yield ev
+
+
+def iter_local_events(path: str) -> Iterator[Dict]:
+    """
+    Đọc chat log đã export ra máy local: một file .ndjson/.ndjson.gz hoặc cả thư mục
+    (các file được đọc theo thứ tự tên, tức cũ đến mới với tên YYYY/MM/DD).
+    """
+    root = Path(path)
+    files = sorted(p for p in root.rglob('*') if p.name.endswith(LOG_SUFFIXES)) if root.is_dir() else [root]
+    for f in files:
+        with open(f, 'rb') as body:
+            yield from iter_ndjson_events(body, compressed=f.name.endswith('.gz'))
+
+
+def open_log_events(key: str) -> Tuple[Iterator[Dict], int]:
+    """
+    Mở một file chat log trên S3 để đọc dạng stream, tự giải nén nếu là gzip.
+
+    Returns:
+        (events, content_length): generator các event và số bytes của object;
+        body được đóng khi generator chạy hết hoặc bị hủy
+    """
+    obj = settings.s3_client.get_object(Bucket=settings.AWS_S3_BUCKET, Key=key)
+    body = obj['Body']
+    compressed = key.endswith('.gz') or (obj.get('ContentEncoding') or '').lower() == 'gzip'
+
+    def events():
+        try:
+            yield from iter_ndjson_events(body, compressed=compressed)
+        finally:
+            body.close()
+
+    return events(), obj.get('ContentLength', 0)
+
+
+def fetch_objects(
+    keys: List[str],
+    loader: Callable[[str], T],
+    max_workers: Optional[int] = None,
+) -> List[Tuple[str, Optional[T], Optional[Exception]]]:
+    """
+    Gọi loader(key) cho từng key bằng một ThreadPoolExecutor có giới hạn.
+
+    Các worker dùng chung settings.s3_client (boto3 client thread-safe, connection pool
+    được cấu hình theo KB_S3_FETCH_WORKERS trong settings).
+
+    Returns:
+        List[(key, result, error)] đúng theo thứ tự keys đầu vào; error khác None nếu loader lỗi
+    """
+    if not keys:
+        return []
+    workers = max_workers if max_workers is not None else settings.KB_S3_FETCH_WORKERS
+    workers = max(1, min(workers, len(keys)))
+
+    def run(key: str):
+        try:
+            return key, loader(key), None
+        except Exception as e:
+            return key, None, e
+
+    if workers == 1:
+        return [run(key) for key in keys]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="S3Fetch") as executor:
+        # executor.map giữ nguyên thứ tự đầu vào
+        return list(executor.map(run, keys))
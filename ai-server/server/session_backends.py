@@ -0,0 +1,212 @@
+"""
+Session backends - Lưu conversation memory ngoài process (dùng chung giữa các worker, giữ qua restart)
+Mặc định memory.py giữ session trong dict của từng process; backend ở đây là tùy chọn
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from . import settings
+from .sqlite_store import SQLitePool
+
+# (role, content, created_at): role là giá trị int của memory.Role
+MessageRow = Tuple[int, str, float]
+
+
+class SessionBackend:
+    """Interface cho session store dùng chung."""
+
+    name = 'none'
+
+    def touch(self, session_id: str) -> None:
+        pass
+
+    def append(self, session_id: str, role: int, content: str, created_at: float) -> None:
+        pass
+
+    def tail(self, session_id: str, max_messages: int) -> List[MessageRow]:
+        return []
+
+    def delete(self, session_id: str) -> None:
+        pass
+
+    def expire(self, cutoff: float) -> int:
+        """Xóa các session có hoạt động cuối trước `cutoff` (epoch), trả về số session đã xóa."""
+        return 0
+
+    def stats(self) -> Dict:
+        return {'backend': self.name}
+
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    Session store trên SQLite (WAL): nhiều worker cùng đọc/ghi một file, session giữ qua restart.
+
+    Mỗi process giữ một LRU nhỏ các session đang hoạt động (messages + version). Mỗi lần ghi tăng
+    version của session; khi đọc chỉ cần so version (tra theo primary key) để biết cache còn đúng,
+    nếu worker khác đã ghi thì tải lại messages.
+    """
+
+    name = 'sqlite'
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sessions (
+        session_id TEXT PRIMARY KEY,
+        last_activity REAL NOT NULL,
+        version INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions(last_activity);
+    CREATE TABLE IF NOT EXISTS session_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id TEXT NOT NULL,
+        role INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_session_messages_session ON session_messages(session_id, id);
+    """
+
+    def __init__(self, path: str, max_messages: int, hot_cache_size: int):
+        self.db = SQLitePool(path, self.SCHEMA)
+        self.max_messages = max_messages
+        self.hot_cache_size = hot_cache_size
+        # session_id -> (version, messages); LRU theo thứ tự truy cập
+        self._hot: OrderedDict[str, Tuple[int, Deque[MessageRow]]] = OrderedDict()
+        self._hot_lock = threading.Lock()
+        self.hot_hits = 0
+        self.hot_misses = 0
+        self.expired = 0
+
+    def _cache(self, session_id: str, version: int, messages: Deque[MessageRow]) -> None:
+        with self._hot_lock:
+            self._hot[session_id] = (version, messages)
+            self._hot.move_to_end(session_id)
+            while len(self._hot) > self.hot_cache_size:
+                self._hot.popitem(last=False)
+
+    def _drop(self, session_id: str) -> None:
+        with self._hot_lock:
+            self._hot.pop(session_id, None)
+
+    def touch(self, session_id: str) -> None:
+        # Chỉ cập nhật hoạt động cuối, messages không đổi nên giữ nguyên version
+        self.db.execute(
+            "INSERT INTO sessions (session_id, last_activity) VALUES (?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET last_activity = excluded.last_activity",
+            (session_id, time.time()),
+        )
+
+    def append(self, session_id: str, role: int, content: str, created_at: float) -> None:
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO sessions (session_id, last_activity, version) VALUES (?, ?, 1) "
+                "ON CONFLICT(session_id) DO UPDATE SET last_activity = excluded.last_activity, version = version + 1",
+                (session_id, created_at),
+            )
+            conn.execute(
+                "INSERT INTO session_messages (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                (session_id, role, content, created_at),
+            )
+            # Giữ lại max_messages messages gần nhất
+            conn.execute(
+                "DELETE FROM session_messages WHERE session_id = ? AND id <= "
+                "(SELECT id FROM session_messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (session_id, session_id, self.max_messages),
+            )
+            (version,) = conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+
+        # Cache đang ở đúng version trước đó -> append tại chỗ, ngược lại bỏ để lần đọc sau tải lại
+        with self._hot_lock:
+            cached = self._hot.get(session_id)
+            if cached is not None:
+                if cached[0] == version - 1:
+                    cached[1].append((role, content, created_at))
+                    self._hot[session_id] = (version, cached[1])
+                else:
+                    del self._hot[session_id]
+
+    def _load(self, session_id: str) -> Optional[Tuple[int, Deque[MessageRow]]]:
+        # Đọc version và messages trong cùng một snapshot
+        with self.db.transaction(immediate=False) as conn:
+            row = conn.execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            rows = conn.execute(
+                "SELECT role, content, created_at FROM session_messages WHERE session_id = ? "
+                "ORDER BY id DESC LIMIT ?",
+                (session_id, self.max_messages),
+            ).fetchall()
+        rows.reverse()
+        return row[0], deque(rows, maxlen=self.max_messages)
+
+    def tail(self, session_id: str, max_messages: int) -> List[MessageRow]:
+        row = self.db.fetchone("SELECT version FROM sessions WHERE session_id = ?", (session_id,))
+        if row is None:
+            self._drop(session_id)
+            return []
+        with self._hot_lock:
+            cached = self._hot.get(session_id)
+            if cached is not None and cached[0] == row[0]:
+                self._hot.move_to_end(session_id)
+                self.hot_hits += 1
+                messages = cached[1]
+                return list(messages)[-max_messages:]
+            self.hot_misses += 1
+        loaded = self._load(session_id)
+        if loaded is None:
+            return []
+        self._cache(session_id, *loaded)
+        return list(loaded[1])[-max_messages:]
+
+    def delete(self, session_id: str) -> None:
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        self._drop(session_id)
+
+    def expire(self, cutoff: float) -> int:
+        with self.db.transaction() as conn:
+            expired = [r[0] for r in conn.execute(
+                "SELECT session_id FROM sessions WHERE last_activity < ?", (cutoff,)
+            ).fetchall()]
+            for session_id in expired:
+                conn.execute("DELETE FROM session_messages WHERE session_id = ?", (session_id,))
+            conn.execute("DELETE FROM sessions WHERE last_activity < ?", (cutoff,))
+        for session_id in expired:
+            self._drop(session_id)
+        self.expired += len(expired)
+        return len(expired)
+
+    def stats(self) -> Dict:
+        (live,) = self.db.fetchone("SELECT COUNT(*) FROM sessions")
+        (page_count,) = self.db.fetchone("PRAGMA page_count")
+        (page_size,) = self.db.fetchone("PRAGMA page_size")
+        with self._hot_lock:
+            hot = len(self._hot)
+        return {
+            'backend': self.name,
+            'path': self.db.path,
+            'live_sessions': live,
+            'expired_sessions': self.expired,
+            'approx_bytes': page_count * page_size,
+            'hot_sessions': hot,
+            'hot_cache_size': self.hot_cache_size,
+            'hot_hits': self.hot_hits,
+            'hot_misses': self.hot_misses,
+        }
+
+
+def create_session_backend(max_messages: int) -> Optional[SessionBackend]:
+    """Tạo session backend theo settings.SESSION_BACKEND ('memory' = dict trong process)."""
+    backend = settings.SESSION_BACKEND
+    if backend == 'sqlite':
+        try:
+            return SQLiteSessionBackend(settings.SESSION_SQLITE_PATH, max_messages, settings.SESSION_HOT_CACHE_SIZE)
+        except Exception as e:
+            print(f"[WARN][Memory] Failed to open SQLite session store {settings.SESSION_SQLITE_PATH}: {e}")
+            return None
+    if backend != 'memory':
+        print(f"[WARN][Memory] Unknown SESSION_BACKEND '{backend}', using in-process sessions")
+    return None
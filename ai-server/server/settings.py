@@ -54,6 +54,8 @@ LEARNING_S3_PREFIX = os.getenv('LEARNING_S3_PREFIX', 'chat-logs')
 # Auto-reload knowledge base từ AWS định kỳ (giây), 0 để tắt
 LEARNING_AUTO_RELOAD_INTERVAL = int(os.getenv('LEARNING_AUTO_RELOAD_INTERVAL', '300'))  # Mặc định 5 phút
 LEARNING_AUTO_RELOAD_ENABLED = os.getenv('LEARNING_AUTO_RELOAD_ENABLED', 'true').lower() == 'true'
+# Số luồng tải song song các file chat log từ S3 (dùng chung một boto3 client)
+KB_S3_FETCH_WORKERS = max(1, int(os.getenv('KB_S3_FETCH_WORKERS', '8')))
 
 # Tự học chủ động - Tự động phân tích và học từ conversations (không cần feedback)
 LEARNING_AUTO_LEARN_ENABLED = os.getenv('LEARNING_AUTO_LEARN_ENABLED', 'true').lower() == 'true'
@@ -61,10 +63,28 @@ LEARNING_AUTO_LEARN_INTERVAL = int(os.getenv('LEARNING_AUTO_LEARN_INTERVAL', '60
 LEARNING_MIN_SCORE_THRESHOLD = float(os.getenv('LEARNING_MIN_SCORE_THRESHOLD', '0.5'))  # Điểm tối thiểu để học (0.0-1.0)
 LEARNING_MAX_AUTO_LEARN_ITEMS = int(os.getenv('LEARNING_MAX_AUTO_LEARN_ITEMS', '10'))  # Số Q&A tối đa học mỗi lần chạy
 
+# Snapshot KB trên đĩa local (ghi sau mỗi lần reload, nạp khi khởi động), để trống để tắt
+KB_SNAPSHOT_PATH = os.getenv('KB_SNAPSHOT_PATH', str(Path(__file__).parent.parent / 'data' / 'kb_snapshot.json'))
+
 # KB Matching thresholds
 KB_SIMILARITY_THRESHOLD = float(os.getenv('KB_SIMILARITY_THRESHOLD', '0.8'))
 KB_JACCARD_THRESHOLD = float(os.getenv('KB_JACCARD_THRESHOLD', '0.3'))
 
+# KB retrieval engine: 'classic' (SequenceMatcher + Jaccard) hoặc 'bm25'
+KB_RETRIEVAL_MODE = os.getenv('KB_RETRIEVAL_MODE', 'classic').strip().lower()
+KB_TOP_K = int(os.getenv('KB_TOP_K', '5'))  # Số kết quả mặc định của find_top_k_answers
+KB_SEARCH_MAX_QUERIES = int(os.getenv('KB_SEARCH_MAX_QUERIES', '100'))  # Số câu hỏi tối đa mỗi request /kb/search
+KB_SEARCH_MAX_K = int(os.getenv('KB_SEARCH_MAX_K', '50'))  # k tối đa cho /kb/search
+KB_BM25_K1 = float(os.getenv('KB_BM25_K1', '1.5'))
+KB_BM25_B = float(os.getenv('KB_BM25_B', '0.75'))
+# Số ứng viên (xếp theo Dice trigram) được kiểm tra lại bằng SequenceMatcher, 0 = chạy SequenceMatcher trên mọi ứng viên
+KB_SEQ_CANDIDATES = int(os.getenv('KB_SEQ_CANDIDATES', '20'))
+KB_LATENCY_SAMPLES = int(os.getenv('KB_LATENCY_SAMPLES', '1000'))  # Số mẫu latency giữ lại cho p50/p99
+# Chỉ để chẩn đoán: tỉ lệ lượt tìm kiếm đo thêm đường cũ (full SequenceMatcher) để so sánh latency.
+# Full scan chạy ngay trên thread của request (hàng trăm ms với KB vài nghìn Q&A) nên mặc định tắt
+KB_LATENCY_BASELINE_SAMPLE_RATE = float(os.getenv('KB_LATENCY_BASELINE_SAMPLE_RATE', '0'))
+KB_BM25_THRESHOLD = float(os.getenv('KB_BM25_THRESHOLD', '0.5'))  # Điểm BM25 chuẩn hóa tối thiểu (0.0-1.0)
+
 # Conversation history length used when calling models
 MAX_HISTORY_MESSAGES = int(os.getenv('MAX_HISTORY_MESSAGES', '20'))
 
@@ -78,13 +98,48 @@ GOOGLE_GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models
 OLLAMA_HOST = os.getenv('OLLAMA_HOST', 'http://localhost:11434')
 OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama3.1')
 
+# Số chuỗi đã chuẩn hóa (normalize_text) được memo trong mỗi process
+NORMALIZE_CACHE_SIZE = int(os.getenv('NORMALIZE_CACHE_SIZE', '4096'))
+
 # Response caching
 ENABLE_RESPONSE_CACHE = os.getenv('ENABLE_RESPONSE_CACHE', 'true').lower() == 'true'
 RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '3600'))  # 1 giờ
+# Admission cho L1: 'lru' (luôn nhận entry mới) hoặc 'tinylfu' (chỉ nhận nếu được hỏi nhiều hơn LRU victim)
+RESPONSE_CACHE_ADMISSION = os.getenv('RESPONSE_CACHE_ADMISSION', 'lru').strip().lower()
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', '0'))  # Ngân sách bytes cho L1, 0 = chỉ giới hạn theo số entry
+RESPONSE_CACHE_SWEEP_INTERVAL = float(os.getenv('RESPONSE_CACHE_SWEEP_INTERVAL', '60'))  # giây giữa các lần dọn entry hết hạn
+RESPONSE_CACHE_SWEEP_BATCH = int(os.getenv('RESPONSE_CACHE_SWEEP_BATCH', '500'))  # entry tối đa xóa mỗi lần giữ lock
+# Tier 2: tìm gần đúng theo tập tokens của message (cùng context), ngưỡng Jaccard 0.0-1.0
+RESPONSE_CACHE_SEMANTIC_ENABLED = os.getenv('RESPONSE_CACHE_SEMANTIC_ENABLED', 'false').lower() == 'true'
+RESPONSE_CACHE_SEMANTIC_THRESHOLD = float(os.getenv('RESPONSE_CACHE_SEMANTIC_THRESHOLD', '0.8'))
+RESPONSE_CACHE_SEMANTIC_MAX_DIFF = int(os.getenv('RESPONSE_CACHE_SEMANTIC_MAX_DIFF', '1'))  # Số token khác nhau tối đa (cả hai phía)
+# Warm-up khi khởi động: '' (tắt), 'aws' (S3 + DynamoDB chat logs) hoặc đường dẫn file/thư mục ndjson local
+RESPONSE_CACHE_WARMUP = os.getenv('RESPONSE_CACHE_WARMUP', '').strip()
+RESPONSE_CACHE_WARMUP_MAX_ITEMS = int(os.getenv('RESPONSE_CACHE_WARMUP_MAX_ITEMS', '500'))  # số entry tối đa nạp sẵn
+RESPONSE_CACHE_WARMUP_MIN_COUNT = int(os.getenv('RESPONSE_CACHE_WARMUP_MIN_COUNT', '2'))  # chỉ nạp câu hỏi xuất hiện >= N lần
+RESPONSE_CACHE_WARMUP_MAX_OBJECTS = int(os.getenv('RESPONSE_CACHE_WARMUP_MAX_OBJECTS', '7'))  # số ngày log gần nhất (file S3 / partition DynamoDB) được đọc
+# L2 cache dùng chung giữa các worker: 'memory' (chỉ L1 trong process) hoặc 'sqlite'
+RESPONSE_CACHE_BACKEND = os.getenv('RESPONSE_CACHE_BACKEND', 'memory').strip().lower()
+SQLITE_POOL_SIZE = int(os.getenv('SQLITE_POOL_SIZE', '4'))  # Số connection tối đa mỗi file SQLite (L2 cache, session store) mỗi process
+RESPONSE_CACHE_SQLITE_PATH = os.getenv('RESPONSE_CACHE_SQLITE_PATH', str(Path(__file__).parent.parent / 'data' / 'response_cache.sqlite3'))
+RESPONSE_CACHE_SHARED_MAX_SIZE = int(os.getenv('RESPONSE_CACHE_SHARED_MAX_SIZE', '10000'))
+
+# Replay cached response khi streaming: 0 = flush một lần, > 0 = khoảng cách (ms) giữa các chunk đã lưu
+STREAM_CACHE_REPLAY_DELAY_MS = float(os.getenv('STREAM_CACHE_REPLAY_DELAY_MS', '0'))
+
+# Gộp các request giống hệt nhau (cùng cache key) đang chạy đồng thời thành một lần gọi model
+ENABLE_REQUEST_COALESCING = os.getenv('ENABLE_REQUEST_COALESCING', 'true').lower() == 'true'
+REQUEST_COALESCING_TIMEOUT = float(os.getenv('REQUEST_COALESCING_TIMEOUT', '300'))  # giây chờ leader tối đa
 
 # Conversation memory
 ENABLE_CONVERSATION_MEMORY = os.getenv('ENABLE_CONVERSATION_MEMORY', 'true').lower() == 'true'
 SESSION_TIMEOUT_HOURS = int(os.getenv('SESSION_TIMEOUT_HOURS', '24'))
+SESSION_SHARDS = int(os.getenv('SESSION_SHARDS', '16'))  # Số phân vùng (mỗi phân vùng một lock) của session store
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'memory').lower()  # 'memory' (dict trong process) hoặc 'sqlite' (dùng chung giữa các worker)
+SESSION_SQLITE_PATH = os.getenv('SESSION_SQLITE_PATH', str(Path(__file__).parent.parent / 'data' / 'sessions.sqlite3'))
+SESSION_HOT_CACHE_SIZE = int(os.getenv('SESSION_HOT_CACHE_SIZE', '256'))  # Số session giữ trong LRU của mỗi process (backend sqlite)
+SESSION_MAX_COUNT = int(os.getenv('SESSION_MAX_COUNT', '10000'))  # Số session tối đa trong bộ nhớ (0 = không giới hạn)
+SESSION_MAX_BYTES = int(os.getenv('SESSION_MAX_BYTES', '0'))  # Bytes ước lượng tối đa của session store (0 = không giới hạn)
 
 # Response validation
 ENABLE_RESPONSE_VALIDATION = os.getenv('ENABLE_RESPONSE_VALIDATION', 'true').lower() == 'true'
@@ -113,7 +168,10 @@ if boto3 and AWS_REGION and (AWS_S3_BUCKET or AWS_DDB_TABLE):
         print("[Settings] Warning: AWS_REGION and bucket/table configured but AWS_ACCESS_KEY_ID or AWS_SECRET_ACCESS_KEY missing")
     
     try:
-        s3_client = boto3.client('s3', region_name=AWS_REGION, **aws_credentials)
+        # Connection pool đủ lớn cho các luồng tải song song (mặc định của botocore là 10)
+        from botocore.config import Config  # type: ignore
+        s3_config = Config(max_pool_connections=max(10, KB_S3_FETCH_WORKERS))
+        s3_client = boto3.client('s3', region_name=AWS_REGION, config=s3_config, **aws_credentials)
         if DEBUG:
             print(f"[Settings] S3 client initialized successfully (region: {AWS_REGION})")
     except Exception as e:
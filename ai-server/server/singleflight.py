@@ -0,0 +1,167 @@
+"""
+Single-flight - Gộp các request giống hệt nhau đang chạy đồng thời
+Request đầu tiên (leader) gọi model; các request trùng key (follower) chờ kết quả
+hoặc đăng ký nhận cùng luồng chunk thay vì gọi model thêm lần nữa
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Iterable, Iterator, Tuple
+
+
+class _Call:
+    """Trạng thái của một lần gọi đang chạy."""
+
+    __slots__ = ('cond', 'started_at', 'done', 'result', 'error', 'chunks', 'followers')
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.started_at = time.monotonic()
+        self.done = False
+        self.result = None
+        self.error = None
+        self.chunks = []
+        self.followers = 0
+
+    def publish(self, chunk: str) -> None:
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+    def finish(self, result=None, error: BaseException = None) -> None:
+        with self.cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+
+class SingleFlight:
+    """
+    Gộp các lần gọi cùng key. Follower chờ tối đa `timeout` giây (không có tiến triển);
+    call quá `timeout` mà chưa xong được coi là treo và không nhận thêm follower.
+    """
+
+    def __init__(self, timeout: float = 300.0):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def _join(self, key: str) -> Tuple[_Call, bool]:
+        """Trả về (call, is_leader)."""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None and time.monotonic() - call.started_at < self.timeout:
+                with call.cond:
+                    call.followers += 1
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            return call, True
+
+    def _release(self, key: str, call: _Call) -> None:
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def do(self, key: str, fn: Callable):
+        """
+        Chạy fn() một lần cho mỗi key đang in-flight.
+
+        Returns:
+            (result, shared): shared=True nếu kết quả lấy từ lần gọi của leader khác
+        """
+        call, leader = self._join(key)
+        if not leader:
+            with call.cond:
+                finished = call.cond.wait_for(lambda: call.done, self.timeout)
+                call.followers -= 1
+            if finished:
+                if call.error is not None:
+                    raise call.error
+                return call.result, True
+            # Leader quá lâu: tự gọi thay vì chờ tiếp
+            return fn(), False
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self._release(key, call)
+            call.finish(error=e)
+            raise
+        self._release(key, call)
+        call.finish(result=result)
+        return result, False
+
+    def stream(self, key: str, factory: Callable[[], Iterable[str]]) -> Tuple[Iterator[str], bool]:
+        """
+        Stream chunks từ factory() một lần cho mỗi key đang in-flight.
+        Follower nhận lại các chunk đã phát rồi tiếp tục nhận chunk mới của leader.
+        Giá trị return của generator factory() (vd. nguồn câu trả lời) là giá trị return
+        của iterator ở cả leader và follower.
+
+        Returns:
+            (iterator, shared): shared=True nếu iterator là follower của stream khác
+        """
+        call, leader = self._join(key)
+        if leader:
+            return self._lead(key, call, factory), False
+        return self._follow(call), True
+
+    def _lead(self, key: str, call: _Call, factory: Callable[[], Iterable[str]]) -> Iterator[str]:
+        source = None
+        result = None
+        error = None
+        try:
+            source = iter(factory())
+            while True:
+                try:
+                    chunk = next(source)
+                except StopIteration as stop:
+                    result = stop.value
+                    break
+                call.publish(chunk)
+                yield chunk
+        except GeneratorExit:
+            # Client của leader ngắt kết nối: nếu còn follower thì chạy nốt để họ nhận đủ
+            with call.cond:
+                has_followers = call.followers > 0
+            if has_followers and source is not None:
+                try:
+                    while True:
+                        call.publish(next(source))
+                except StopIteration as stop:
+                    result = stop.value
+                except Exception as e:
+                    error = e
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._release(key, call)
+            call.finish(result=result, error=error)
+        return result
+
+    def _follow(self, call: _Call) -> Iterator[str]:
+        sent = 0
+        try:
+            while True:
+                with call.cond:
+                    if not call.cond.wait_for(lambda: sent < len(call.chunks) or call.done, self.timeout):
+                        print("[WARN][SingleFlight] Timed out waiting for leader stream")
+                        return
+                    pending = call.chunks[sent:]
+                    done = call.done
+                    error = call.error
+                    result = call.result
+                for chunk in pending:
+                    yield chunk
+                sent += len(pending)
+                if done and not pending:
+                    if error is not None:
+                        raise error
+                    return result
+        finally:
+            with call.cond:
+                call.followers -= 1
@@ -0,0 +1,97 @@
+"""
+SQLite helpers - Kết nối SQLite ở chế độ WAL dùng chung giữa nhiều worker process
+Một pool nhỏ các connection dùng lại giữa các thread: server threaded của Werkzeug tạo thread mới
+cho mỗi request nên connection theo thread (threading.local) sẽ phải mở lại và chạy PRAGMA mỗi request
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+from . import settings
+
+
+class SQLitePool:
+    """
+    Pool connection SQLite (WAL) có giới hạn cho một file database.
+
+    Schema và journal_mode=WAL (lưu trong file DB) chỉ chạy một lần khi khởi tạo; mỗi connection
+    chỉ đặt các PRAGMA theo connection (synchronous, busy_timeout) đúng một lần lúc được tạo.
+    Mỗi connection chỉ được một thread dùng tại một thời điểm (mượn/trả qua queue).
+    """
+
+    def __init__(self, path: str, schema: str = "", size: Optional[int] = None, busy_timeout_ms: int = 5000):
+        self.path = path
+        self.size = max(1, size if size is not None else settings.SQLITE_POOL_SIZE)
+        self.busy_timeout_ms = busy_timeout_ms
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        if schema:
+            conn.executescript(schema)
+        self._idle.put(conn)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: autocommit, transaction được mở tường minh bằng BEGIN khi cần
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        self._created += 1
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                return self._connect()
+        # Pool đã đầy: chờ connection được trả lại
+        return self._idle.get(timeout=self.busy_timeout_ms / 1000)
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self, immediate: bool = True) -> Iterator[sqlite3.Connection]:
+        """BEGIN IMMEDIATE (ghi) hoặc BEGIN (đọc nhất quán), COMMIT khi xong, ROLLBACK nếu lỗi."""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def fetchone(self, sql: str, params: tuple = ()) -> Optional[tuple]:
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def execute(self, sql: str, params: tuple = ()) -> int:
+        """Chạy một câu lệnh ghi (autocommit), trả về rowcount."""
+        with self.connection() as conn:
+            return conn.execute(sql, params).rowcount
@@ -3,6 +3,7 @@ from datetime import datetime
 from . import settings
 import re
 import unicodedata
+from functools import lru_cache
 
 
 def get_timestamp():
@@ -64,7 +65,8 @@ def strip_accents(text: str) -> str:
     return without
 
 
-def normalize_text(text: str) -> str:
+def normalize_text_reference(text: str) -> str:
+    """Cài đặt gốc (NFD + lọc Mn + regex), dùng để đối chiếu với normalize_text."""
     if not text:
         return ""
     t = strip_accents(text).lower()
@@ -73,7 +75,55 @@ def normalize_text(text: str) -> str:
     return t
 
 
+def _build_normalize_table() -> tuple[dict, re.Pattern]:
+    """
+    Bảng str.translate cho ASCII, Latin-1/Latin Extended (gồm chữ tiếng Việt dựng sẵn),
+    Latin Extended Additional và dấu kết hợp U+0300-036F: mỗi ký tự -> kết quả của
+    cài đặt gốc trên riêng ký tự đó (bỏ dấu, lowercase, ký tự không phải chữ -> ' ').
+    Giống cài đặt gốc, đ/Đ không bị NFD tách nên giữ thành 'đ'.
+    Trả về (table, regex tìm ký tự nằm ngoài bảng).
+    """
+    ranges = [(0x00, 0x7F), (0xC0, 0x24F), (0x300, 0x36F), (0x1E00, 0x1EFF)]
+    table = {}
+    covered = []
+    for lo, hi in ranges:
+        for code in range(lo, hi + 1):
+            ch = chr(code)
+            mapped = _NON_WORD_RE.sub(" ", strip_accents(ch).lower())
+            if mapped != ch:
+                table[code] = mapped
+            covered.append(re.escape(ch))
+    return table, re.compile("[^" + "".join(covered) + "]")
+
+
+_NORMALIZE_TABLE, _UNCOVERED_RE = _build_normalize_table()
+
+
+def _normalize_fast(text: str) -> str:
+    if _UNCOVERED_RE.search(text):
+        # Có ký tự ngoài bảng (CJK, emoji, ...): dùng cài đặt gốc
+        return normalize_text_reference(text)
+    return " ".join(text.translate(_NORMALIZE_TABLE).split())
+
+
+# Memo LRU cho các chuỗi lặp lại (cache key, KB, dedup); chuỗi dài không được memo
+_NORMALIZE_MEMO_MAX_LEN = 512
+_normalize_memo = lru_cache(maxsize=settings.NORMALIZE_CACHE_SIZE)(_normalize_fast)
+
+
+def normalize_text(text: str) -> str:
+    if not text:
+        return ""
+    if len(text) > _NORMALIZE_MEMO_MAX_LEN:
+        return _normalize_fast(text)
+    return _normalize_memo(text)
+
+
 def tokenize_keywords(text: str) -> list[str]:
-    norm = normalize_text(text)
+    return tokenize_normalized(normalize_text(text))
+
+
+def tokenize_normalized(norm: str) -> list[str]:
+    """Tách keywords từ chuỗi đã qua normalize_text (bỏ qua bước chuẩn hóa lại)."""
     tokens = [w for w in norm.split(" ") if len(w) >= 2]
     return tokens